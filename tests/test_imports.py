@@ -0,0 +1,25 @@
+"""Names that other code imports from ubitool.commands.utils."""
+
+import importlib
+
+
+def test_htail_reader_importable_from_utils():
+    from ubitool.commands.utils import HtailReader
+    from ubitool.commands.htail import HtailReader as moved
+    assert HtailReader is moved
+
+
+def test_baseline_names_importable_from_utils():
+    utils = importlib.import_module("ubitool.commands.utils")
+    for name in ("get_new_content_as_string", "read_new_content", "execute_htail_logic", "get_htail_content_for_session"):
+        assert callable(getattr(utils, name)), name
+
+
+def test_unknown_name_raises_attribute_error():
+    utils = importlib.import_module("ubitool.commands.utils")
+    try:
+        utils.no_such_name
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("expected AttributeError")
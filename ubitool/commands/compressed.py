@@ -0,0 +1,181 @@
+"""Transparent reading of compressed logs for ubitool commands."""
+
+import os
+import io
+import bz2
+import json
+import lzma
+import zlib
+import base64
+import collections
+from .utils import TAIL_BLOCK_SIZE, find_last_lines_offset
+
+
+# Decompressors for rotated logs; each has .eof and .unused_data so that
+# concatenated members (cat a.gz b.gz, multi-stream bz2/xz) can be located
+_DECOMPRESSORS = {
+    '.gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    '.bz2': bz2.BZ2Decompressor,
+    '.xz': lzma.LZMADecompressor,
+}
+
+# Amount of decompressed data at the end of the stream kept in the index
+COMPRESSED_TAIL_CACHE_SIZE = 64 * 1024
+
+_COMPRESSED_INDEX_VERSION = 1
+
+
+def is_compressed_file(file: str) -> bool:
+    """Return True if the file is a compressed log that tail/htail decompress transparently."""
+    return os.path.splitext(file)[1].lower() in _DECOMPRESSORS
+
+
+def get_compressed_index_file(file: str) -> str:
+    """Return the path of the seek index for a compressed file (.FILE.zidx),
+    kept next to the file."""
+    file_dir = os.path.dirname(os.path.abspath(file))
+    file_name = os.path.basename(file)
+    return os.path.join(file_dir, f".{file_name}.zidx")
+
+
+def _iter_members(file: str, compressed_offset: int = 0):
+    """Decompress a file starting at a member boundary.
+    Yields (member_start, chunk) where member_start is the compressed offset
+    of the member the chunk belongs to."""
+    new_decompressor = _DECOMPRESSORS[os.path.splitext(file)[1].lower()]
+    with open(file, 'rb') as f:
+        f.seek(compressed_offset)
+        member_start = compressed_offset
+        decompressor = new_decompressor()
+        data = b''
+        while True:
+            if not data:
+                data = f.read(TAIL_BLOCK_SIZE)
+                if not data:
+                    return
+            try:
+                chunk = decompressor.decompress(data)
+            except (zlib.error, OSError, lzma.LZMAError, EOFError):
+                # Trailing garbage or padding after the last member is ignored
+                if member_start != compressed_offset:
+                    return
+                raise
+            if chunk:
+                yield member_start, chunk
+            if not decompressor.eof:
+                data = b''
+                continue
+            # A member ended inside this block; the rest starts the next one
+            data = decompressor.unused_data
+            member_start = f.tell() - len(data)
+            decompressor = new_decompressor()
+
+
+def load_compressed_index(file: str) -> dict:
+    """Return the seek index of a compressed log, building it if needed.
+    
+    The index holds the uncompressed size, the (compressed, uncompressed)
+    offsets of every member and the last COMPRESSED_TAIL_CACHE_SIZE bytes of
+    decompressed data. It is persisted in .FILE.zidx and rebuilt only when
+    the compressed file changes, so tail and htail on a rotated log
+    decompress the stream at most once.
+    The standard library cannot resume inflation in the middle of a member,
+    so member boundaries are the finest random-access checkpoints."""
+    st = os.stat(file)
+    index_file = get_compressed_index_file(file)
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if (index.get('version') == _COMPRESSED_INDEX_VERSION and
+                index.get('compressed_size') == st.st_size and
+                index.get('mtime_ns') == st.st_mtime_ns):
+            index['tail'] = base64.b64decode(index['tail'])
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    
+    members = []
+    size = 0
+    tail = bytearray()
+    for member_start, chunk in _iter_members(file):
+        if not members or members[-1][0] != member_start:
+            members.append([member_start, size])
+        size += len(chunk)
+        tail += chunk
+        if len(tail) > 2 * COMPRESSED_TAIL_CACHE_SIZE:
+            del tail[:-COMPRESSED_TAIL_CACHE_SIZE]
+    tail = bytes(tail[-COMPRESSED_TAIL_CACHE_SIZE:])
+    
+    index = {
+        'version': _COMPRESSED_INDEX_VERSION,
+        'compressed_size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'size': size,
+        'members': members,
+        'tail_offset': size - len(tail),
+        'tail': tail,
+    }
+    try:
+        with open(index_file, 'w') as f:
+            json.dump(dict(index, tail=base64.b64encode(tail).decode('ascii')), f)
+    except OSError:
+        pass  # The index is only a cache; read-only directories still work
+    return index
+
+
+def iter_compressed_range(file: str, index: dict, start: int, end: int = None):
+    """Yield the decompressed bytes [start, end) of a compressed log.
+    Served from the cached tail when possible, otherwise decompression starts
+    at the last member boundary at or before start."""
+    if end is None:
+        end = index['size']
+    if start >= end:
+        return
+    
+    tail_offset = index['tail_offset']
+    if start >= tail_offset:
+        yield index['tail'][start - tail_offset:end - tail_offset]
+        return
+    
+    compressed_offset, offset = 0, 0
+    for member_compressed, member_uncompressed in index['members']:
+        if member_uncompressed > start:
+            break
+        compressed_offset, offset = member_compressed, member_uncompressed
+    
+    for _, chunk in _iter_members(file, compressed_offset):
+        chunk_end = offset + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(0, start - offset):end - offset]
+        offset = chunk_end
+        if offset >= end:
+            return
+
+
+def find_compressed_last_lines_offset(file: str, index: dict, lines: int, start: int = 0) -> int:
+    """Find where the last N lines of a compressed log begin (uncompressed offset).
+    The cached tail answers this directly for small N; otherwise the stream is
+    scanned once, keeping only the trailing chunks that hold N line breaks."""
+    tail = index['tail']
+    tail_offset = index['tail_offset']
+    local_start = max(0, start - tail_offset)
+    offset = find_last_lines_offset(io.BytesIO(tail), lines, local_start)
+    if offset > local_start or tail_offset <= start:
+        return tail_offset + offset
+    
+    window = collections.deque()
+    window_newlines = 0
+    position = start
+    for chunk in iter_compressed_range(file, index, start):
+        window.append((position, chunk))
+        window_newlines += chunk.count(b'\n')
+        position += len(chunk)
+        # Drop leading chunks once the rest still holds enough line breaks
+        while len(window) > 1 and window_newlines - window[0][1].count(b'\n') > lines:
+            window_newlines -= window.popleft()[1].count(b'\n')
+    
+    if not window:
+        return start
+    window_start = window[0][0]
+    data = b''.join(chunk for _, chunk in window)
+    return window_start + find_last_lines_offset(io.BytesIO(data), lines)
@@ -0,0 +1,190 @@
+"""File change notification (inotify, or stat polling) for ubitool commands."""
+
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+# inotify constants from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_IGNORED = 0x00008000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_inotify():
+    """Return libc if it provides inotify, otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """Wait for changes on a set of files.
+    
+    Uses a single inotify descriptor for all files (IN_MODIFY, IN_MOVE_SELF, ...)
+    plus a watch on each parent directory so that re-created files are noticed.
+    Falls back to stat polling when inotify is not available.
+    wait() returns the set of paths that may have changed; an empty set means
+    the timeout elapsed and callers should check every file themselves.
+    Directories added with add_directory() are returned when an entry is
+    created in or moved into them."""
+    
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self.paths = set()
+        self._fd = None
+        self._libc = _load_inotify()
+        self._file_watches = {}  # wd -> path
+        self._path_watches = {}  # path -> wd
+        self._dir_watches = {}   # wd -> {name: path}
+        self._dir_wds = {}       # directory -> wd
+        self._reported_dirs = {} # wd -> directory, for add_directory()
+        self._stats = {}         # path -> stat signature (polling only)
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+    
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+    
+    def add(self, path: str):
+        """Start (or restart, after the file was replaced) watching a path.
+        Adding a path that is already watched at its current inode does nothing."""
+        if self._fd is None:
+            if path not in self.paths:
+                self.paths.add(path)
+                self._stats[path] = self._stat_signature(path)
+            return
+        self.paths.add(path)
+        
+        # inotify returns the existing watch for an inode that is already watched
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _IN_MODIFY | _IN_ATTRIB | _IN_MOVE_SELF | _IN_DELETE_SELF)
+        old_wd = self._path_watches.get(path)
+        if old_wd is not None and old_wd == wd:
+            return
+        
+        # Drop the watch on the previous inode; removing it queues an IN_IGNORED event
+        if old_wd is not None:
+            del self._path_watches[path]
+            self._file_watches.pop(old_wd, None)
+            if old_wd not in self._path_watches.values():
+                self._libc.inotify_rm_watch(self._fd, old_wd)
+        if wd >= 0:
+            self._file_watches[wd] = path
+            self._path_watches[path] = wd
+        
+        dir_wd = self._watch_directory(os.path.dirname(os.path.abspath(path)))
+        if dir_wd is not None:
+            self._dir_watches[dir_wd][os.path.basename(path)] = path
+    
+    def add_directory(self, directory: str):
+        """Start watching a directory for new entries (e.g. a new log file)."""
+        directory = os.path.abspath(directory)
+        if self._fd is None:
+            # The mtime of a directory changes when an entry is added
+            self.paths.add(directory)
+            self._stats[directory] = self._stat_signature(directory)
+            return
+        dir_wd = self._watch_directory(directory)
+        if dir_wd is not None:
+            self._reported_dirs[dir_wd] = directory
+    
+    def _watch_directory(self, directory: str) -> int:
+        """Return the inotify watch of a directory (IN_CREATE, IN_MOVED_TO), adding it if needed."""
+        dir_wd = self._dir_wds.get(directory)
+        if dir_wd is None:
+            dir_wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_CREATE | _IN_MOVED_TO)
+            if dir_wd < 0:
+                return None
+            self._dir_wds[directory] = dir_wd
+            self._dir_watches[dir_wd] = {}
+        return dir_wd
+    
+    def wait(self, timeout: float) -> set:
+        """Block until a watched file changes or timeout seconds elapse."""
+        if self._fd is None:
+            return self._poll(timeout)
+        
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except InterruptedError:
+            return set()
+        if not readable:
+            return set()
+        
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += _INOTIFY_EVENT.size
+                name = buffer[offset:offset + name_len].rstrip(b'\0')
+                offset += name_len
+                
+                if wd in self._file_watches:
+                    changed.add(self._file_watches[wd])
+                    if mask & _IN_IGNORED:
+                        path = self._file_watches.pop(wd)
+                        if self._path_watches.get(path) == wd:
+                            del self._path_watches[path]
+                elif wd in self._dir_watches:
+                    path = self._dir_watches[wd].get(os.fsdecode(name))
+                    if path is not None:
+                        changed.add(path)
+                    if wd in self._reported_dirs:
+                        changed.add(self._reported_dirs[wd])
+        return changed
+    
+    def _poll(self, timeout: float) -> set:
+        """Stat every watched path once after sleeping for timeout seconds."""
+        time.sleep(timeout)
+        changed = set()
+        for path in self.paths:
+            signature = self._stat_signature(path)
+            if signature != self._stats.get(path):
+                self._stats[path] = signature
+                changed.add(path)
+        return changed
+    
+    @staticmethod
+    def _stat_signature(path: str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
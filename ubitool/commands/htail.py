@@ -0,0 +1,1151 @@
+"""Htail logic shared between the htail, shtail and stssend commands."""
+
+import os
+import re
+import json
+import mmap
+import codecs
+import contextlib
+import collections
+import time
+import signal
+import concurrent.futures
+from .utils import TAIL_BLOCK_SIZE, find_last_lines_offset, compile_grep_pattern, filter_lines, iter_filtered_chunks, find_last_matching_lines, silence_stdout
+from .utils import iter_file_range, StdoutWriter, write_chunks, LineIndex, _incomplete_utf8_length
+from .terminal import normalize_terminal_output, TerminalNormalizer
+from .compressed import is_compressed_file, load_compressed_index, iter_compressed_range, find_compressed_last_lines_offset
+from .file_watcher import FileWatcher
+from .position_store import DEFAULT_CURSOR, Cursor, PositionStore, get_position_store, resolve_position, check_cursor
+
+
+# Seconds between cursor checkpoints of htail --follow
+HTAIL_CHECKPOINT_INTERVAL = 5.0
+
+# Default number of files htail reads at the same time
+HTAIL_JOBS = 8
+
+# htail output windows at least this large are streamed instead of buffered
+STREAM_THRESHOLD = 1024 * 1024
+
+# While streaming, the position is committed after about this many bytes
+STREAM_COMMIT_INTERVAL = 4 * 1024 * 1024
+
+
+def find_read_end(file: str, last_position: int, complete_lines: bool = False) -> int:
+    """Return where htail should stop reading the unread data of a file.
+    
+    A writer may be in the middle of a character or a line. The position is
+    never committed inside a UTF-8 character, and with complete_lines not
+    inside a line either; the partial tail is left for the next read, so every
+    byte is shown once and in one piece. Compressed logs are complete and
+    are read to the end (None)."""
+    if is_compressed_file(file):
+        return None
+    with open(file, 'rb') as f:
+        end_position = os.fstat(f.fileno()).st_size
+        if end_position <= last_position:
+            return end_position
+        if not complete_lines:
+            tail = os.pread(f.fileno(), min(3, end_position - last_position), end_position - min(3, end_position - last_position))
+            return end_position - _incomplete_utf8_length(tail)
+        
+        # Scan backward for the last newline, never below last_position
+        block_end = end_position
+        while block_end > last_position:
+            block_start = max(last_position, block_end - TAIL_BLOCK_SIZE)
+            block = os.pread(f.fileno(), block_end - block_start, block_start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return block_start + newline + 1
+            block_end = block_start
+        return last_position
+
+
+def _find_window_start(source, last_position: int, end_position: int, lines: int, bytes_count: int, compressed_file: str = None) -> int:
+    """Return where the displayed part of the unread data [last_position, end_position) starts.
+    source is an open binary file, or the seek index of compressed_file."""
+    if bytes_count is not None:
+        return max(last_position, end_position - bytes_count)
+    if lines:
+        if compressed_file is not None:
+            return find_compressed_last_lines_offset(compressed_file, source, lines, last_position)
+        return find_last_lines_offset(source, lines, last_position, end_position)
+    return last_position
+
+
+def _read_new_window(file: str, last_position: int, lines: int, bytes_count: int, regex=None, end: int = None) -> tuple[bytes, int, bool]:
+    """Read the part of the unread data that will be displayed.
+    Returns (content, end_position, found_new_content).
+    Only the last N lines (or bytes_count bytes) are read: the file is scanned
+    backward from EOF (or end) and never below last_position, so memory use
+    depends on the output size and not on how much is unread."""
+    if is_compressed_file(file):
+        index = load_compressed_index(file)
+        end_position = index['size'] if end is None else min(end, index['size'])
+        if end_position <= last_position:
+            return b'', last_position, False
+        if regex is not None:
+            chunks = iter_filtered_chunks(iter_compressed_range(file, index, last_position, end_position), regex, split=True)
+            matched = list(collections.deque(chunks, maxlen=lines)) if bytes_count is None and lines else list(chunks)
+            content = b''.join(matched)
+        else:
+            start_position = _find_window_start(index, last_position, end_position, lines, bytes_count, file)
+            content = b''.join(iter_compressed_range(file, index, start_position, end_position))
+    else:
+        with open(file, 'rb') as f:
+            end_position = os.fstat(f.fileno()).st_size
+            if end is not None:
+                end_position = min(end, end_position)
+            if end_position <= last_position:
+                return b'', last_position, False
+            if regex is not None:
+                matched = find_last_matching_lines(f, regex, lines if bytes_count is None else None, last_position, end_position, bytes_count=bytes_count)
+                content = b''.join(matched)
+            else:
+                start_position = _find_window_start(f, last_position, end_position, lines, bytes_count)
+                f.seek(start_position)
+                content = f.read(end_position - start_position)
+    
+    if bytes_count is not None and len(content) > bytes_count:
+        content = content[-bytes_count:]
+    return content, end_position, True
+
+
+def _get_end_position(file: str) -> int:
+    """Return the end of file position (uncompressed size for compressed logs)."""
+    if is_compressed_file(file):
+        return load_compressed_index(file)['size']
+    with open(file, 'rb') as f:
+        f.seek(0, 2)  # Go to end of file
+        return f.tell()
+
+
+def _read_rotated_window(rotated: tuple, shown: bytes, lines: int, bytes_count: int, regex=None) -> tuple[bytes, bool]:
+    """Read the unread rest of a rotated-out file that still fits in the window.
+    shown is what the current file already puts in the window; the limits
+    apply to both files together."""
+    rotated_file, rotated_position = rotated
+    if bytes_count is not None:
+        bytes_count -= len(shown)
+        if bytes_count <= 0:
+            return b'', False
+    elif lines:
+        lines -= shown.count(b'\n') + (1 if shown and not shown.endswith(b'\n') else 0)
+        if lines <= 0:
+            return b'', False
+    content, _, found = _read_new_window(rotated_file, rotated_position, lines, bytes_count, regex)
+    return content, found
+
+
+def get_new_content_as_string(file: str, store: "PositionStore", last_position: int, lines: int, bytes_count: int, update_position: bool = True, regex=None, rotated: tuple = None, end: int = None, normalize: bool = False) -> tuple[str, bool]:
+    """Helper function to read new content from file since last position and return as string.
+    Returns tuple of (content_string, found_new_content).
+    If update_position is False, the saved position will not be updated (keep mode).
+    If regex (see compile_grep_pattern) is given, only matching lines are returned;
+    they are selected on the raw bytes, before decoding.
+    rotated (see resolve_position) is a rotated-out file whose unread rest comes first.
+    end, if given, is where reading stops instead of EOF.
+    With normalize, terminal escapes and \\r redraws are cleaned up (see normalize_terminal_output)."""
+    try:
+        # Only the displayed window is read; the position still moves to EOF
+        output_content, current_position, found_new_content = _read_new_window(file, last_position, lines, bytes_count, regex, end)
+        
+        if rotated is not None:
+            rotated_content, found_rotated = _read_rotated_window(rotated, output_content, lines, bytes_count, regex)
+            output_content = rotated_content + output_content
+            found_new_content = found_new_content or found_rotated
+        
+        if found_new_content:
+            if bytes_count is not None:
+                # A byte window may start inside a character
+                skip = 0
+                while skip < min(3, len(output_content)) and output_content[skip] & 0xC0 == 0x80:
+                    skip += 1
+                output_content = output_content[skip:]
+            
+            if normalize:
+                output_content = normalize_terminal_output(output_content)
+            
+            # Convert to text, handling encoding
+            try:
+                content_str = output_content.decode('utf-8')
+            except UnicodeDecodeError:
+                content_str = output_content.decode('utf-8', errors='replace')
+            
+            # Save the new position (only if update_position is True)
+            if update_position:
+                store.set(file, current_position)
+            return content_str, True
+        
+        return "", False
+    
+    except Exception as e:
+        print(f"Error reading file '{file}': {e}")
+        return "", False
+
+
+def read_new_content(file: str, store: "PositionStore", last_position: int, lines: int, bytes_count: int, update_position: bool = True, regex=None, rotated: tuple = None, end: int = None, normalize: bool = False) -> bool:
+    """Helper function to read new content from file since last position.
+    Returns True if new content was found and displayed, False otherwise.
+    If update_position is False, the saved position will not be updated (keep mode).
+    Without a limit, or when the window to display is large, the content is
+    streamed in chunks instead of being built into one string."""
+    if lines is None and bytes_count is None:
+        drained = False
+        if rotated is not None:
+            # Drain the rotated-out file first; the cursor moves on to the new file
+            rotated_file, rotated_position = rotated
+            drained = stream_new_content(rotated_file, store, rotated_position, rotated_position, False, regex, normalize=normalize)
+            if update_position:
+                store.set(file, last_position)
+        return stream_new_content(file, store, last_position, last_position, update_position, regex, end=end, normalize=normalize) or drained
+    
+    if regex is None and rotated is None:
+        start_position, end_position = _find_new_window(file, last_position, lines, bytes_count, end)
+        if end_position - start_position >= STREAM_THRESHOLD:
+            return stream_new_content(file, store, last_position, start_position, update_position, end=end_position, normalize=normalize)
+    
+    # Use the shared function to get content as string
+    content_str, found_content = get_new_content_as_string(file, store, last_position, lines, bytes_count, update_position, regex, rotated, end, normalize)
+    
+    if found_content:
+        print(content_str, end='')
+        return True
+    
+    return False
+
+
+def _find_new_window(file: str, last_position: int, lines: int, bytes_count: int, end: int = None) -> tuple[int, int]:
+    """Return the (start, end) offsets of the window htail would display."""
+    if is_compressed_file(file):
+        index = load_compressed_index(file)
+        end_position = index['size'] if end is None else min(end, index['size'])
+        if end_position <= last_position:
+            return last_position, last_position
+        return _find_window_start(index, last_position, end_position, lines, bytes_count, file), end_position
+    
+    with open(file, 'rb') as f:
+        end_position = os.fstat(f.fileno()).st_size
+        if end is not None:
+            end_position = min(end, end_position)
+        if end_position <= last_position:
+            return last_position, last_position
+        return _find_window_start(f, last_position, end_position, lines, bytes_count), end_position
+
+
+def _iter_unread_chunks(chunks, start_position: int, regex=None):
+    """Yield (output, line_end) for each raw chunk read from start_position.
+    line_end is the offset just past the last complete line consumed so far
+    (None if there is none yet); it is where a cursor may safely be committed."""
+    position = start_position
+    pending = b''
+    line_end = None
+    for chunk in chunks:
+        position += len(chunk)
+        data = pending + chunk
+        cut = data.rfind(b'\n') + 1
+        if cut:
+            line_end = position - (len(data) - cut)
+        if regex is None:
+            yield chunk, line_end
+            continue
+        pending = data[cut:]
+        yield filter_lines(regex, data[:cut]), line_end
+    if pending:
+        yield filter_lines(regex, pending), position
+
+
+def stream_new_content(file: str, store: "PositionStore", last_position: int, start_position: int, update_position: bool = True, regex=None, commit_interval: int = STREAM_COMMIT_INTERVAL, end: int = None, normalize: bool = False) -> bool:
+    """Write the unread data from start_position to EOF (or end) to stdout in fixed-size chunks.
+    Memory use stays flat regardless of the backlog size. The position is
+    committed only after stdout was flushed: every commit_interval bytes at the
+    last complete line, and at the end of the data. With normalize, the chunks
+    pass through a TerminalNormalizer."""
+    f = None
+    if is_compressed_file(file):
+        index = load_compressed_index(file)
+        end_position = index['size'] if end is None else min(end, index['size'])
+        chunks = iter_compressed_range(file, index, start_position, end_position)
+    else:
+        f = open(file, 'rb')
+        # Data appended while streaming is left for the next run
+        end_position = os.fstat(f.fileno()).st_size
+        if end is not None:
+            end_position = min(end, end_position)
+        chunks = iter_file_range(f, start_position, end_position)
+    
+    try:
+        if end_position <= last_position:
+            return False
+        
+        writer = StdoutWriter()
+        normalizer = TerminalNormalizer() if normalize else None
+        uncommitted = 0
+        for output, line_end in _iter_unread_chunks(chunks, start_position, regex):
+            uncommitted += len(output)
+            writer.write(normalizer.feed(output) if normalizer is not None else output)
+            if update_position and uncommitted >= commit_interval and line_end is not None:
+                writer.flush()
+                store.set(file, line_end)
+                uncommitted = 0
+        if normalizer is not None:
+            writer.write(normalizer.flush(final=True))
+        writer.flush(final=True)
+        
+        if update_position:
+            store.set(file, end_position)
+        return True
+    finally:
+        if f is not None:
+            f.close()
+
+
+def count_unread(file: str, last_position: int) -> tuple[int, int]:
+    """Return (lines, bytes) after last_position without reading the unread data.
+    Plain files use the sidecar line index, which only scans data appended since
+    its last update; compressed logs are counted from their decompressed stream."""
+    if is_compressed_file(file):
+        index = load_compressed_index(file)
+        unread_bytes = max(0, index['size'] - last_position)
+        newlines = sum(chunk.count(b'\n') for chunk in iter_compressed_range(file, index, last_position))
+        partial = 1 if unread_bytes and not index['tail'].endswith(b'\n') else 0
+        return newlines + partial, unread_bytes
+    
+    with open(file, 'rb') as f:
+        index = LineIndex.open(file, f)
+        unread_bytes = max(0, index.indexed_end - last_position)
+        if unread_bytes == 0:
+            return 0, 0
+        unread_newlines = index.newline_count - index.count_newlines_before(f, last_position)
+        return unread_newlines + (0 if index.ends_with_newline else 1), unread_bytes
+
+
+def cursor_lag(path: str, cursor: Cursor) -> tuple[int, str]:
+    """Return (lag_bytes, state) of a saved cursor from a stat of its file.
+    state is 'ok', 'rotated' (the file was replaced or truncated; the lag is
+    then the whole new file) or 'missing' (lag is None)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, "missing"
+    end_position = _get_end_position(path) if is_compressed_file(path) else st.st_size
+    if cursor.ino is not None and ((st.st_dev, st.st_ino) != (cursor.dev, cursor.ino) or st.st_size < cursor.size):
+        return end_position, "rotated"
+    return max(0, end_position - cursor.position), "ok"
+
+
+def print_cursor_lags(files: list = None):
+    """Print every saved cursor (or those of the given files) with its lag in bytes."""
+    store = get_position_store()
+    rows = [row for file in files for row in store.list_cursors(file)] if files else store.list_cursors()
+    if not rows:
+        print("No saved cursors.")
+        return
+    
+    table = []
+    for name, path, cursor, _ in rows:
+        lag, state = cursor_lag(path, cursor)
+        table.append((name, "-" if lag is None else str(lag), str(cursor.position), state, path))
+    _print_table(("CURSOR", "LAG", "POSITION", "STATE", "FILE"), table)
+
+
+def _print_table(headers: tuple, table: list):
+    """Print rows of strings in aligned columns; the last column is not padded."""
+    widths = [max(len(row[i]) for row in table + [headers]) for i in range(len(headers) - 1)]
+    for row in [headers] + table:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)) + "  " + row[-1])
+
+
+# Amount of a memory-mapped file counted at a time by count_newlines
+NEWLINE_COUNT_CHUNK = 1024 * 1024
+
+
+def count_newlines(file: str, start: int, end: int = None) -> tuple[int, bool]:
+    """Count the newlines in bytes [start, end) of a plain file.
+    Returns (newlines, ends_with_newline). The file is memory-mapped and
+    counted with bytes.count() one chunk at a time, so nothing is decoded
+    and memory use does not grow with the file."""
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if end <= start:
+            return 0, True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            newlines = 0
+            for position in range(start, end, NEWLINE_COUNT_CHUNK):
+                newlines += mm[position:min(end, position + NEWLINE_COUNT_CHUNK)].count(b'\n')
+            return newlines, mm[end - 1] == ord('\n')
+
+
+def _unread_stats(file: str, cursor: Cursor) -> dict:
+    """Return the unread backlog of one file for htail --stats (in a worker thread)."""
+    last_position, rotated = check_cursor(file, cursor)
+    if is_compressed_file(file):
+        unread_lines, unread_bytes = count_unread(file, last_position)
+        size = _get_end_position(file)
+    else:
+        size = os.stat(file).st_size
+        unread_bytes = max(0, size - last_position)
+        newlines, ends_with_newline = count_newlines(file, last_position, size)
+        unread_lines = newlines + (0 if ends_with_newline else 1)
+    
+    if rotated is not None:
+        rotated_lines, rotated_bytes = count_unread(*rotated)
+        unread_lines += rotated_lines
+        unread_bytes += rotated_bytes
+    return {
+        'file': file,
+        'position': last_position,
+        'size': size,
+        'unread_bytes': unread_bytes,
+        'unread_lines': unread_lines,
+        'rotated': rotated[0] if rotated is not None else None,
+    }
+
+
+def print_htail_stats(files: list, cursor: str = DEFAULT_CURSOR, jobs: int = HTAIL_JOBS, as_json: bool = False):
+    """Print the unread bytes and lines of every file (htail --stats).
+    The files are counted in parallel; nothing is shown or committed."""
+    store = get_position_store(cursor)
+    existing = []
+    for file in files:
+        if os.path.exists(file):
+            existing.append(file)
+        elif not as_json:
+            print(f"Warning: File '{file}' does not exist.")
+    
+    cursors = {file: store.get_cursor(file) for file in existing}
+    stats = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(_unread_stats, file, cursors[file]) for file in existing]
+        for file, future in zip(existing, futures):
+            try:
+                stats.append(future.result())
+            except Exception as e:
+                if as_json:
+                    stats.append({'file': file, 'error': str(e)})
+                else:
+                    print(f"Error reading file '{file}': {e}")
+    
+    if as_json:
+        print(json.dumps({'cursor': cursor, 'files': stats}, indent=2))
+        return
+    
+    table = [(str(item['unread_bytes']), str(item['unread_lines']), str(item['position']), str(item['size']), item['file'])
+             for item in stats if 'error' not in item]
+    if table:
+        _print_table(("UNREAD_BYTES", "UNREAD_LINES", "POSITION", "SIZE", "FILE"), table)
+
+
+def _prepare_htail_options(lines: int, bytes_count: int, all_content: bool, grep: str) -> tuple:
+    """Apply the htail defaults and check the limits.
+    Returns (lines, bytes_count, regex), or None after printing what is wrong."""
+    # Set default values if neither option is specified
+    if all_content:
+        lines, bytes_count = None, None  # Stream everything that is unread
+    elif lines is None and bytes_count is None:
+        lines = 10  # Default to 10 lines
+    
+    if lines is not None and lines <= 0:
+        print("Warning: Number of lines must be greater than 0.")
+        return None
+    
+    if bytes_count is not None and bytes_count <= 0:
+        print("Warning: Number of bytes must be greater than 0.")
+        return None
+    
+    try:
+        regex = compile_grep_pattern(grep) if grep is not None else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        return None
+    return lines, bytes_count, regex
+
+
+def execute_htail_logic(file: str, lines: int, bytes_count: int, reset: bool, last: bool, keep: bool, count: bool = False, grep: str = None, all_content: bool = False, cursor: str = DEFAULT_CURSOR, follow: bool = False, checkpoint_interval: float = HTAIL_CHECKPOINT_INTERVAL, sleep_interval: float = 1.0, complete_lines: bool = False, normalize: bool = False, session_key: tuple = None):
+    """Execute htail logic on a specific file - shared between htail and shtail commands
+    session_key ((directory, session, window, pane)) marks the file as the
+    latest log of a tmux pane: the unread rest of the log the pane was read
+    from before is shown first (see resolve_session_rollover)."""
+    # Check if file exists
+    if not os.path.exists(file):
+        print(f"Warning: File '{file}' does not exist.")
+        return
+    
+    options = _prepare_htail_options(lines, bytes_count, all_content, grep)
+    if options is None:
+        return
+    lines, bytes_count, regex = options
+    
+    try:
+        # Positions of all files are kept in one central store, per named cursor
+        store = get_position_store(cursor)
+        
+        # Readers of the same cursor take turns: each one resumes where the
+        # previous one stopped, so no content is shown twice
+        locked = reset or last or not (keep or count)
+        with store.lock(file) if locked else contextlib.nullcontext():
+            # Handle reset option
+            if reset:
+                store.delete(file)
+                last_position, rotated = 0, None
+            else:
+                # Read the last saved position, following the file if it was rotated
+                last_position, rotated = resolve_position(store, file)
+                if rotated is None and session_key is not None:
+                    rotated = resolve_session_rollover(store, session_key, file)
+            
+            # Handle last option (mark current end as read)
+            if last:
+                current_position = _get_end_position(file)
+                store.set(file, current_position)
+                if session_key is not None:
+                    store.set_session_file(session_key, file)
+                return
+            
+            # Handle count option (report unread amount without displaying it)
+            if count:
+                unread_lines, unread_bytes = count_unread(file, last_position)
+                if rotated is not None:
+                    rotated_lines, rotated_bytes = count_unread(*rotated)
+                    unread_lines += rotated_lines
+                    unread_bytes += rotated_bytes
+                print(f"{unread_lines} unread line(s), {unread_bytes} unread byte(s)")
+                return
+            
+            if follow and is_compressed_file(file):
+                print(f"Warning: Compressed file '{file}' cannot be followed.")
+                follow = False
+            if follow:
+                # The reader is opened first so nothing appended during the first read is missed
+                reader = HtailReader(file, store=store, check_interval=0, position=last_position)
+            end_position = find_read_end(file, last_position, complete_lines)
+            
+            # Read new content (keep mode affects whether position is updated)
+            read_new_content(file, store, last_position, lines, bytes_count, not keep, regex, rotated, end_position, normalize)
+            if session_key is not None and not keep:
+                store.set_session_file(session_key, file)
+        
+        if follow:
+            reader.session_key = session_key
+            reader.position = max(end_position, last_position)
+            reader.load_saved_position()
+            with reader:
+                follow_new_content([reader], regex, not keep, checkpoint_interval, sleep_interval, complete_lines, normalize=normalize)
+    
+    except BrokenPipeError:
+        # Output was cut short (e.g. piped to head); the position was committed
+        # only up to what had been flushed
+        silence_stdout()
+    except Exception as e:
+        print(f"Error reading file '{file}': {e}")
+
+
+def _collect_unread(file: str, cursor: Cursor, lines: int, bytes_count: int, regex, count: bool, complete_lines: bool = False, previous: tuple = None) -> tuple:
+    """Read what htail would show for one file of a multi-file run (in a worker thread).
+    Returns (last_position, rotated, start_position, end_position, content).
+    content is None when the window is too large to buffer and has to be
+    streamed from start_position, and is a summary line with count.
+    previous is (file, Cursor) of the log a tmux pane was read from before."""
+    last_position, rotated = check_cursor(file, cursor)
+    if rotated is None and previous is not None:
+        rotated = _unread_rest(previous[0], check_cursor(*previous)[0])
+    if count:
+        unread_lines, unread_bytes = count_unread(file, last_position)
+        if rotated is not None:
+            rotated_lines, rotated_bytes = count_unread(*rotated)
+            unread_lines += rotated_lines
+            unread_bytes += rotated_bytes
+        return last_position, rotated, None, None, f"{unread_lines} unread line(s), {unread_bytes} unread byte(s)"
+    
+    end = find_read_end(file, last_position, complete_lines)
+    if lines is None and bytes_count is None:
+        return last_position, rotated, last_position, _get_end_position(file) if end is None else end, None
+    if regex is None and rotated is None:
+        start_position, end_position = _find_new_window(file, last_position, lines, bytes_count, end)
+        if end_position - start_position >= STREAM_THRESHOLD:
+            return last_position, rotated, start_position, end_position, None
+    
+    content, end_position, _ = _read_new_window(file, last_position, lines, bytes_count, regex, end)
+    if rotated is not None:
+        rotated_content, _ = _read_rotated_window(rotated, content, lines, bytes_count, regex)
+        content = rotated_content + content
+    return last_position, rotated, None, end_position, content
+
+
+def execute_htail_files(files: list, lines: int, bytes_count: int, reset: bool, last: bool, keep: bool, count: bool = False, grep: str = None, all_content: bool = False, cursor: str = DEFAULT_CURSOR, jobs: int = HTAIL_JOBS, complete_lines: bool = False, follow: bool = False, checkpoint_interval: float = HTAIL_CHECKPOINT_INTERVAL, sleep_interval: float = 1.0, labels: dict = None, normalize: bool = False, session_keys: dict = None):
+    """Execute htail logic on several files in one process.
+    
+    The files are read by a bounded pool of threads; the output is grouped
+    per file (with a '==> FILE <==' header, only for files with new content)
+    in the order the files were given, and the new positions of all files
+    are committed together in one transaction at the end. labels maps files
+    to the names shown in the headers instead of their paths, and
+    session_keys the files that are tmux pane logs to their pane (see
+    execute_htail_logic).
+    
+    With follow, all files are then followed at once (see follow_new_content)."""
+    options = _prepare_htail_options(lines, bytes_count, all_content, grep)
+    if options is None:
+        return
+    lines, bytes_count, regex = options
+    
+    existing = []
+    for file in files:
+        if os.path.exists(file):
+            existing.append(file)
+        else:
+            print(f"Warning: File '{file}' does not exist.")
+    
+    store = get_position_store(cursor)
+    with contextlib.ExitStack() as locks:
+        if reset or last or not (keep or count):
+            # Locks are always taken in the same order, so two runs cannot deadlock
+            for file in sorted(existing, key=store.key):
+                locks.enter_context(store.lock(file))
+        
+        if reset:
+            with store.batch():
+                for file in existing:
+                    store.delete(file)
+        
+        if last:
+            # Mark current end of every file as read
+            with store.batch():
+                for file in existing:
+                    try:
+                        store.set(file, _get_end_position(file))
+                    except Exception as e:
+                        print(f"Error reading file '{file}': {e}")
+            return
+        
+        positions = _read_htail_files(store, existing, lines, bytes_count, keep, count, regex, jobs, complete_lines, labels or {}, normalize, session_keys or {})
+    
+    if follow and not count and positions:
+        follow_htail_files(store, positions, regex, not keep, checkpoint_interval, sleep_interval, complete_lines, labels, normalize, session_keys)
+
+
+def _read_htail_files(store: PositionStore, existing: list, lines: int, bytes_count: int, keep: bool, count: bool, regex, jobs: int, complete_lines: bool, labels: dict, normalize: bool = False, session_keys: dict = None) -> dict:
+    """Show the new content of several files and commit their positions (see execute_htail_files).
+    Returns {file: position read up to} for the files that were read, or None if output was cut short."""
+    # SQLite is only used from this thread; workers just touch the files
+    cursors = {file: store.get_cursor(file) for file in existing}
+    # The log each tmux pane was last read from, with its saved cursor
+    previous = {}
+    for file, session_key in (session_keys or {}).items():
+        previous_file = store.get_session_file(session_key)
+        if previous_file is not None and previous_file != file:
+            previous[file] = (previous_file, store.get_cursor(previous_file))
+    positions = {}
+    new_positions = {}
+    first = True
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(_collect_unread, file, cursors[file], lines, bytes_count, regex, count, complete_lines, previous.get(file)) for file in existing]
+            for file, future in zip(existing, futures):
+                try:
+                    last_position, rotated, start_position, end_position, content = future.result()
+                except Exception as e:
+                    print(f"Error reading file '{file}': {e}")
+                    continue
+                
+                label = labels.get(file, file)
+                if count:
+                    print(f"{label}: {content}")
+                    continue
+                
+                if content is None and end_position <= last_position and rotated is None:
+                    positions[file] = last_position
+                    continue
+                
+                if content is None or content:
+                    if not first:
+                        print()
+                    print(f"==> {label} <==", flush=True)
+                    first = False
+                
+                if content is None:
+                    # Large windows are streamed in order instead of being buffered
+                    if rotated is not None:
+                        stream_new_content(rotated[0], store, rotated[1], rotated[1], False, regex, normalize=normalize)
+                    stream_new_content(file, store, last_position, start_position, False, regex, end=end_position, normalize=normalize)
+                elif content:
+                    write_chunks([normalize_terminal_output(content) if normalize else content])
+                
+                if end_position > last_position or rotated is not None:
+                    new_positions[file] = end_position
+                positions[file] = new_positions.get(file, last_position)
+    
+    except BrokenPipeError:
+        # Nothing is committed when the output was cut short
+        silence_stdout()
+        return None
+    
+    if not keep and (new_positions or session_keys):
+        with store.batch():
+            for file, position in new_positions.items():
+                store.set(file, position)
+            for file, session_key in (session_keys or {}).items():
+                if file in positions:
+                    store.set_session_file(session_key, file)
+    return positions
+
+
+class HtailReader:
+    """Incremental reader of one file for in-process pollers (e.g. stssend).
+    
+    The file is opened once and the read offset is kept in memory: a poll
+    that finds nothing new costs a single os.pread(). The position is only
+    saved to the store by commit(). Whether the file was truncated or
+    replaced is checked at most every check_interval seconds; a replaced
+    file is drained before the reader switches to the new one.
+    
+    With session_key ((directory, session, window, pane)) the reader follows
+    a tmux pane rather than one file: check_session_rollover() moves it on
+    to the newest log of the pane once tmux logging restarts into a new file,
+    after draining the old one.
+        
+        with HtailReader(log_file, cursor="bot") as reader:
+            data = reader.read()
+            reader.commit()"""
+    
+    def __init__(self, file: str, cursor: str = DEFAULT_CURSOR, store: PositionStore = None, check_interval: float = 1.0, block_size: int = TAIL_BLOCK_SIZE, position: int = None, session_key: tuple = None):
+        if is_compressed_file(file):
+            raise ValueError(f"HtailReader cannot follow compressed file '{file}'")
+        self.file = file
+        self.store = store if store is not None else get_position_store(cursor)
+        self.check_interval = check_interval
+        self.block_size = block_size
+        self.fd = None
+        # Unread rest of a rotated-out file, returned by the next read()
+        self.pending = b''
+        # Keeps a character split between two reads for read_text()
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.session_key = session_key
+        # The pane log last recorded as read by commit()
+        self._session_file = None
+        if position is None:
+            # Start at the saved cursor, unless the caller already knows where to start
+            position, rotated = resolve_position(self.store, file)
+            if rotated is None and session_key is not None:
+                rotated = resolve_session_rollover(self.store, session_key, file)
+            if rotated is not None:
+                self.pending = _read_new_window(rotated[0], rotated[1], None, None)[0]
+        self.position = position
+        self.load_saved_position()
+        self.fd = os.open(file, os.O_RDONLY)
+        self._next_check = time.monotonic() + check_interval
+    
+    def read(self) -> bytes:
+        """Return the data appended since the last read."""
+        data = self._read_available()
+        if not data and time.monotonic() >= self._next_check and self._check_file():
+            data = self._read_available()
+        return data
+    
+    def read_text(self) -> str:
+        """Return the appended data as text; a character cut off at the end of
+        the data is completed by a later call instead of being replaced."""
+        return self.decoder.decode(self.read())
+    
+    def _read_available(self) -> bytes:
+        chunks = [self.pending] if self.pending else []
+        self.pending = b''
+        while True:
+            chunk = os.pread(self.fd, self.block_size, self.position)
+            self.position += len(chunk)
+            if chunk:
+                chunks.append(chunk)
+            if len(chunk) < self.block_size:
+                break
+        return b''.join(chunks)
+    
+    def _check_file(self) -> bool:
+        """Follow a truncated or replaced file; returns True if it was."""
+        self._next_check = time.monotonic() + self.check_interval
+        current = os.fstat(self.fd)
+        if current.st_size < self.position:
+            self.position = 0  # Truncated in place
+            return True
+        try:
+            st = os.stat(self.file)
+        except OSError:
+            return False  # Removed; the open file is kept until a new one appears
+        if (st.st_dev, st.st_ino) == (current.st_dev, current.st_ino):
+            return False
+        
+        # Drain what was written to the old file before it was replaced
+        drained = self._read_available()
+        os.close(self.fd)
+        self.fd = os.open(self.file, os.O_RDONLY)
+        self.position = 0
+        self.pending = drained
+        return True
+    
+    def check_session_rollover(self) -> bool:
+        """Move on to the newest log of the reader's tmux pane if it is not
+        the current file; returns True if the reader switched. The unread rest
+        of the current file is returned by the next read()."""
+        if self.session_key is None:
+            return False
+        directory, target_session, window, pane = self.session_key
+        latest = find_session_log(target_session, directory, window, pane)
+        if latest is None or latest == self.file:
+            return False
+        
+        # Like a rotated file, the old log is drained and the cursor moves on
+        drained = self._read_available()
+        os.close(self.fd)
+        self.fd = os.open(latest, os.O_RDONLY)
+        self.file = latest
+        # The new log is normally unread; another reader may have started it
+        self.position, _ = resolve_position(self.store, latest)
+        self.pending = drained
+        self.load_saved_position()
+        self._next_check = time.monotonic() + self.check_interval
+        return True
+    
+    def skip_to_end(self):
+        """Mark everything currently in the file (of a tmux pane: its newest log) as read."""
+        self.check_session_rollover()
+        self.pending = b''
+        self.decoder.reset()
+        self.position = os.fstat(self.fd).st_size
+    
+    def load_saved_position(self) -> int:
+        """Remember the position currently saved in the store (None if there is none)."""
+        cursor = self.store.get_cursor(self.file)
+        self.saved_position = cursor.position if cursor is not None else None
+        return self.saved_position
+    
+    def commit(self, position: int = None) -> bool:
+        """Save the in-memory position (or position) to the store.
+        Bytes read_text() is still holding are not counted as read.
+        
+        The save is a compare-and-swap against the position this reader last
+        saw. If another reader of the same cursor has moved it further in the
+        meantime, this reader skips ahead to that position instead, so the two
+        do not go on reading the same data, and False is returned."""
+        if position is None:
+            undecoded, _ = self.decoder.getstate()
+            position = max(0, self.position - len(undecoded))
+        if self.session_key is not None and self._session_file != self.file:
+            self.store.set_session_file(self.session_key, self.file)
+            self._session_file = self.file
+        while not self.store.compare_and_set(self.file, self.saved_position, position):
+            cursor = self.store.get_cursor(self.file)
+            if cursor is not None and cursor.position > position and cursor.ino == os.fstat(self.fd).st_ino:
+                self.saved_position = self.position = cursor.position
+                self.pending = b''
+                self.decoder.reset()
+                return False
+            self.saved_position = cursor.position if cursor is not None else None
+        self.saved_position = position
+        return True
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+class _FollowedReader:
+    """Output state of one reader followed by follow_new_content."""
+    
+    def __init__(self, reader: HtailReader, label: str = None, normalize: bool = False):
+        self.reader = reader
+        self.label = label
+        self.normalizer = TerminalNormalizer() if normalize else None
+        # Unfinished character or line held back until the rest arrives
+        self.pending = b''
+        self.written_position = reader.position
+        self.committed_position = None
+        self.watched_inode = os.fstat(reader.fd).st_ino
+
+
+def follow_new_content(readers: list, regex=None, update_position: bool = True, checkpoint_interval: float = HTAIL_CHECKPOINT_INTERVAL, sleep_interval: float = 1.0, complete_lines: bool = False, labels: list = None, normalize: bool = False):
+    """Print data appended to the readers' files until interrupted (htail --follow).
+    
+    The cursors are checkpointed every checkpoint_interval seconds and once
+    more on SIGINT/SIGTERM, always at the end of what has been flushed to
+    stdout, so a restarted reader resumes exactly where this one stopped. An
+    unfinished UTF-8 character (with regex or complete_lines, an unfinished
+    line) is held back until the rest of it arrives.
+    
+    All files are watched at once; with labels, output is preceded by a
+    '==> LABEL <==' header whenever it comes from another file than before.
+    Readers of a tmux pane (see HtailReader session_key) move on to a new log
+    of the pane when inotify reports it in the log directory.
+    With normalize, each read is cleaned up by a TerminalNormalizer; an
+    unfinished line stays in it (so a later \r can still redraw it) until
+    its newline arrives, it grows past NORMALIZE_MAX_LINE, or following ends."""
+    writer = StdoutWriter()
+    followed = [_FollowedReader(reader, labels[index] if labels is not None else None, normalize) for index, reader in enumerate(readers)]
+    last_label = None
+    next_checkpoint = time.monotonic() + checkpoint_interval
+    previous_handler = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    
+    def write(item, data: bytes):
+        nonlocal last_label
+        if data and item.label is not None and item.label != last_label:
+            writer.write(f"\n==> {item.label} <==\n".encode('utf-8', 'surrogateescape'))
+            last_label = item.label
+        writer.write(data)
+    
+    def checkpoint():
+        nonlocal next_checkpoint
+        next_checkpoint = time.monotonic() + checkpoint_interval
+        for item in followed:
+            if update_position and item.written_position != item.committed_position:
+                if not item.reader.commit(item.written_position):
+                    # Another reader of this cursor got further; continue after it
+                    item.pending = b''
+                    if item.normalizer is not None:
+                        item.normalizer = TerminalNormalizer()
+                    item.written_position = item.reader.position
+                item.committed_position = item.written_position
+    
+    try:
+        with FileWatcher(sleep_interval) as watcher:
+            changed = set()
+            for item in followed:
+                watcher.add(item.reader.file)
+                if item.reader.session_key is not None:
+                    watcher.add_directory(item.reader.session_key[0])
+            while True:
+                for item in followed:
+                    reader = item.reader
+                    if reader.session_key is not None and reader.session_key[0] in changed:
+                        # A new log appeared; the old one is drained by this read
+                        if reader.check_session_rollover():
+                            item.written_position = reader.position
+                    data = reader.read()
+                    if data:
+                        data = item.pending + data
+                        if regex is not None or complete_lines:
+                            cut = data.rfind(b'\n') + 1
+                        else:
+                            cut = len(data) - _incomplete_utf8_length(data)
+                        item.pending = data[cut:]
+                        data = data[:cut]
+                        if regex is not None:
+                            data = filter_lines(regex, data)
+                        held = len(item.pending)
+                        if item.normalizer is not None:
+                            data = item.normalizer.feed(data)
+                            held += len(item.normalizer.pending)
+                        write(item, data)
+                        writer.flush()
+                        item.written_position = max(0, reader.position - held)
+                    
+                    inode = os.fstat(reader.fd).st_ino
+                    if inode != item.watched_inode:
+                        # The reader moved on to a new file (at the same path, or a new pane log)
+                        watcher.add(reader.file)
+                        item.watched_inode = inode
+                
+                if time.monotonic() >= next_checkpoint:
+                    checkpoint()
+                changed = watcher.wait(min(sleep_interval, max(0.0, next_checkpoint - time.monotonic())))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        try:
+            for item in followed:
+                if item.normalizer is not None and item.normalizer.pending:
+                    write(item, item.normalizer.flush(final=True))
+                    item.written_position = max(0, item.reader.position - len(item.pending))
+            writer.flush(final=True)
+        except BrokenPipeError:
+            silence_stdout()
+        checkpoint()
+
+
+def follow_htail_files(store: PositionStore, positions: dict, regex=None, update_position: bool = True, checkpoint_interval: float = HTAIL_CHECKPOINT_INTERVAL, sleep_interval: float = 1.0, complete_lines: bool = False, labels: dict = None, normalize: bool = False, session_keys: dict = None):
+    """Follow several files from the given positions ({file: position}) with
+    one reader each; the output is labeled per file (see follow_new_content).
+    session_keys maps files that are tmux pane logs to their pane."""
+    labels = labels or {}
+    session_keys = session_keys or {}
+    readers = []
+    try:
+        for file, position in positions.items():
+            if is_compressed_file(file):
+                print(f"Warning: Compressed file '{file}' cannot be followed.")
+                continue
+            readers.append(HtailReader(file, store=store, check_interval=0, position=position, session_key=session_keys.get(file)))
+        if readers:
+            follow_new_content(readers, regex, update_position, checkpoint_interval, sleep_interval, complete_lines,
+                               [labels.get(reader.file, reader.file) for reader in readers], normalize)
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+DEFAULT_SESSION_LOG_PATH = "~/Workspace/log/tmux"
+
+# session_<name>_window_<w>_pane_<p>_<suffix>.log; the name may contain '_'
+_SESSION_LOG_RE = re.compile(r'^session_(.+)_window_(\d+)_pane_(\d+)_.*\.log$')
+
+
+def _scan_session_logs(directory: str) -> dict:
+    """Return {(session, window, pane): (path, mtime_ns)} with the latest log
+    of every tmux pane in a directory (one stat per log file)."""
+    logs = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = _SESSION_LOG_RE.match(entry.name)
+            if match is None:
+                continue
+            try:
+                mtime_ns = entry.stat().st_mtime_ns
+            except OSError:
+                continue  # Removed while scanning
+            key = (match.group(1), int(match.group(2)), int(match.group(3)))
+            if key not in logs or mtime_ns > logs[key][1]:
+                logs[key] = (entry.path, mtime_ns)
+    return logs
+
+
+def index_session_logs(directory: str, session: str = None, refresh: bool = False) -> dict:
+    """Return the latest log of every tmux pane in a directory, or of the
+    panes of one session (see _scan_session_logs).
+    
+    Scanning a directory with tens of thousands of logs on every poll is
+    slow, so the result is kept in the position database and reused while
+    the mtime of the directory is unchanged, i.e. no log was added, removed
+    or renamed. Appending to a log does not change the directory, so which
+    log of a pane is the latest is only decided again when logs come or go."""
+    directory = os.path.abspath(directory)
+    mtime_ns = os.stat(directory).st_mtime_ns
+    store = get_position_store()
+    logs = None if refresh else store.get_session_logs(directory, mtime_ns, session)
+    if logs is None:
+        scanned_ns = time.time_ns()
+        logs = _scan_session_logs(directory)
+        # A change during the scan moves the mtime past the one saved here
+        store.set_session_logs(directory, mtime_ns, scanned_ns, logs)
+        if session is not None:
+            logs = {key: value for key, value in logs.items() if key[0] == session}
+    return logs
+
+
+def parse_pane_selector(value: str, name: str = "window") -> int:
+    """Parse a --window/--pane value: an index, or 'all' (None)."""
+    if value is None:
+        return 0
+    if value.strip().lower() == "all":
+        return None
+    try:
+        index = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name} '{value}' (expected a number or 'all')") from None
+    if index < 0:
+        raise ValueError(f"Invalid {name} '{value}' (expected a number or 'all')")
+    return index
+
+
+def session_log_pattern(target_session: str, window: int = 0, pane: int = 0) -> str:
+    """Return the glob pattern of the logs of a pane (window/pane None: any)."""
+    window_text = "*" if window is None else window
+    pane_text = "*" if pane is None else pane
+    return f"session_{target_session}_window_{window_text}_pane_{pane_text}_*.log"
+
+
+def pane_label(target_session: str, window: int, pane: int) -> str:
+    """Return the tmux target of a pane (e.g. 'build1:0.1'), used to label its output."""
+    return f"{target_session}:{window}.{pane}"
+
+
+def find_session_logs(target_session: str, output_path: str = None, window: int = 0, pane: int = 0) -> list:
+    """Return [(window, pane, path)] with the latest log of every selected pane
+    of a tmux session, ordered by window and pane. window/pane None selects all."""
+    # Use provided output_path or default log path for tmux sessions
+    log_path = os.path.expanduser(output_path or DEFAULT_SESSION_LOG_PATH)
+    if not os.path.isdir(log_path):
+        return []
+    
+    def select(logs):
+        return sorted((key[1], key[2], path) for key, (path, _) in logs.items()
+                      if (window is None or key[1] == window) and (pane is None or key[2] == pane))
+    
+    selected = select(index_session_logs(log_path, target_session))
+    if any(not os.path.exists(path) for _, _, path in selected):
+        # Removed without the directory mtime changing (e.g. in the same tick)
+        selected = select(index_session_logs(log_path, target_session, refresh=True))
+    return selected
+
+
+def find_session_log(target_session: str, output_path: str = None, window: int = 0, pane: int = 0) -> str:
+    """Return the latest log file of a tmux pane, or None if there is none."""
+    logs = find_session_logs(target_session, output_path, window, pane)
+    return logs[0][2] if logs else None
+
+
+def session_cursor_key(target_session: str, output_path: str, window: int, pane: int) -> tuple:
+    """Return the (directory, session, window, pane) a session cursor is saved under."""
+    directory = os.path.abspath(os.path.expanduser(output_path or DEFAULT_SESSION_LOG_PATH))
+    return directory, target_session, window, pane
+
+
+def _unread_rest(file: str, position: int) -> tuple:
+    """Return (file, position) if a log still has data after position, otherwise None."""
+    try:
+        if position < _get_end_position(file):
+            return file, position
+    except OSError:
+        pass  # Removed (or compressed away) since
+    return None
+
+
+def resolve_session_rollover(store: PositionStore, session_key: tuple, file: str) -> tuple:
+    """Return (previous_file, position) if tmux logging of a pane restarted into
+    file since the cursor last read the pane and the previous log still has
+    unread data, otherwise None. Like a rotated file (see resolve_position),
+    the rest of the previous log is read before the new one."""
+    previous_file = store.get_session_file(session_key)
+    if previous_file is None or previous_file == file or not os.path.exists(previous_file):
+        return None
+    position, _ = resolve_position(store, previous_file)
+    return _unread_rest(previous_file, position)
+
+
+def get_htail_content_for_session(target_session: str, lines: int = None, bytes_count: int = None, keep: bool = True, output_path: str = None, cursor: str = DEFAULT_CURSOR, window: int = 0, pane: int = 0, normalize: bool = False) -> str:
+    """Get new content from tmux session log using htail logic.
+    Returns the new content as a string.
+    Pollers that read the same session repeatedly should use HtailReader."""
+    try:
+        latest_file = find_session_log(target_session, output_path, window, pane)
+        if latest_file is None:
+            return ""  # No log files found
+        
+        # Read the last saved position
+        store = get_position_store(cursor)
+        key = session_cursor_key(target_session, output_path, window, pane)
+        with store.lock(latest_file) if not keep else contextlib.nullcontext():
+            last_position, rotated = resolve_position(store, latest_file)
+            if rotated is None:
+                # Logging may have restarted into a new file; the old one is drained first
+                rotated = resolve_session_rollover(store, key, latest_file)
+            
+            # Get new content as string
+            end_position = find_read_end(latest_file, last_position)
+            content_str, _ = get_new_content_as_string(latest_file, store, last_position, lines, bytes_count, not keep, rotated=rotated, end=end_position, normalize=normalize)
+            if not keep:
+                store.set_session_file(key, latest_file)
+        return content_str
+    
+    except Exception as e:
+        print(f"Error getting content for session '{target_session}': {e}")
+        return ""
@@ -1,22 +1,97 @@
 """Htail command implementation for ubitool."""
 
+import os
+import glob as glob_module
 import typer
-from .utils import execute_htail_logic
+from .htail import execute_htail_logic, execute_htail_files, print_cursor_lags, print_htail_stats, HTAIL_JOBS, HTAIL_CHECKPOINT_INTERVAL
+from .position_store import DEFAULT_CURSOR
 
 
 def htail_command(
-    file: str = typer.Argument(..., help="Path to the file to read."),
+    files: list[str] = typer.Argument(None, help="Paths or glob patterns of the files to read. (Optional with --list-cursors)"),
     lines: int = typer.Option(None, "-n", "--lines", help="Maximum number of new lines to display."),
     bytes_count: int = typer.Option(None, "-c", "--bytes", help="Maximum number of new bytes to display. (Overrides -n if both specified)"),
     reset: bool = typer.Option(False, "--reset", help="Reset the saved position and read from the beginning."),
     last: bool = typer.Option(False, "--last", help="Mark current end of file as read (skip to end without displaying)."),
-    keep: bool = typer.Option(False, "--keep", help="Do not update last read position.")
+    keep: bool = typer.Option(False, "--keep", help="Do not update last read position."),
+    count: bool = typer.Option(False, "--count", help="Print the number of unread lines and bytes without displaying them."),
+    grep: str = typer.Option(None, "--grep", help="Only show new lines matching this regular expression."),
+    all_content: bool = typer.Option(False, "-a", "--all", help="Display all unread content, streamed with constant memory use (overrides -n and -c)."),
+    cursor: str = typer.Option(DEFAULT_CURSOR, "--cursor", help="Name of the read position to use; readers with different cursors do not affect each other."),
+    list_cursors: bool = typer.Option(False, "--list-cursors", help="List the saved cursors (of FILE, or of all files) with their lag in bytes."),
+    jobs: int = typer.Option(HTAIL_JOBS, "-j", "--jobs", help="Number of files read at the same time when several files are given."),
+    follow: bool = typer.Option(False, "-f", "--follow", help="Keep running and print new content as it is appended."),
+    checkpoint_interval: float = typer.Option(HTAIL_CHECKPOINT_INTERVAL, "--checkpoint-interval", help="Seconds between saves of the read position with --follow."),
+    sleep_interval: float = typer.Option(1.0, "-s", "--sleep-interval", help="Seconds between checks with --follow when inotify is not available."),
+    complete_lines: bool = typer.Option(False, "--complete-lines", help="Only show complete lines; a partial last line is left unread until it is finished."),
+    stats: bool = typer.Option(False, "--stats", help="Print the unread bytes and lines of every file as a table, without displaying content."),
+    as_json: bool = typer.Option(False, "--json", help="Print --stats as JSON."),
+    normalize: bool = typer.Option(False, "--normalize", help="Remove terminal escape sequences and apply \\r and backspace redraws (e.g. for tmux pane logs).")
 ):
     """Print the unread portion of a file since last access.
     
     This command tracks the reading position and only displays new content
-    added since the last read. The position is saved in a hidden file
-    (.FILE.htail) in the same directory as the target file."""
+    added since the last read. Positions are saved in a central database
+    (~/.local/state/ubitool/htail.sqlite3, or $UBITOOL_HTAIL_DB).
+    If the file was rotated or truncated since then, the unread rest of the
+    old file is shown first and the new file is read from the beginning.
     
-    # Use shared htail logic
-    execute_htail_logic(file, lines, bytes_count, reset, last, keep)
\ No newline at end of file
+    Compressed logs (.gz, .xz, .bz2) are read transparently; their seek
+    index is kept next to the file (.FILE.zidx).
+    
+    Several files (or glob patterns, e.g. 'logs/*.log') are read in one
+    process; the output is grouped per file in the order given and all
+    positions are saved together at the end; with --follow all of them are
+    then followed at once.
+    
+    With --follow the position is saved every --checkpoint-interval seconds
+    and when htail is stopped (Ctrl-C or SIGTERM), so the next run resumes
+    exactly where this one stopped.
+    
+    The position is never saved inside a UTF-8 character (or, with
+    --complete-lines, inside a line): the unfinished tail is shown by the
+    next read instead.
+    
+    With --normalize, terminal output (colors, cursor movement, progress
+    bars redrawn with \\r) is shown as plain text; positions still refer to
+    the raw file."""
+    
+    files = _expand_paths(files or [])
+    
+    if list_cursors:
+        print_cursor_lags(files)
+        return
+    
+    if not files:
+        print("Error: FILE is required unless --list-cursors is given.")
+        raise typer.Exit(1)
+    
+    if stats or as_json:
+        print_htail_stats(files, cursor, jobs, as_json)
+        return
+    
+    if checkpoint_interval <= 0:
+        print("Warning: Checkpoint interval must be greater than 0.")
+        return
+    
+    if len(files) == 1:
+        # Use shared htail logic
+        execute_htail_logic(files[0], lines, bytes_count, reset, last, keep, count, grep, all_content, cursor, follow, checkpoint_interval, sleep_interval, complete_lines, normalize)
+    else:
+        execute_htail_files(files, lines, bytes_count, reset, last, keep, count, grep, all_content, cursor, jobs, complete_lines, follow, checkpoint_interval, sleep_interval, normalize=normalize)
+
+
+def _expand_paths(patterns: list[str]) -> list[str]:
+    """Expand glob patterns (sorted per pattern); plain paths are kept as given."""
+    files = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if glob_module.has_magic(pattern):
+            matches = sorted(glob_module.glob(pattern))
+            if not matches:
+                print(f"Warning: No files match '{pattern}'.")
+            files.extend(matches)
+        else:
+            files.append(pattern)
+    # The same file given twice is read once
+    return list(dict.fromkeys(files))
\ No newline at end of file
@@ -0,0 +1,426 @@
+"""Saved htail read positions (cursors) for ubitool commands."""
+
+import os
+import lzma
+import zlib
+import hashlib
+import sqlite3
+import contextlib
+import collections
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+from .compressed import is_compressed_file, _iter_members
+
+
+# Bytes at the start of a file hashed to recognize it after rotation
+FINGERPRINT_SIZE = 4096
+
+
+def read_file_head(file: str, length: int) -> bytes:
+    """Return the first length bytes of a file (decompressed for compressed logs)."""
+    if not is_compressed_file(file):
+        with open(file, 'rb') as f:
+            return f.read(length)
+    head = b''
+    members = _iter_members(file)
+    try:
+        for _, chunk in members:
+            head += chunk
+            if len(head) >= length:
+                break
+    finally:
+        members.close()
+    return head[:length]
+
+
+def file_fingerprint(file: str, length: int = FINGERPRINT_SIZE) -> tuple[bytes, int]:
+    """Return (hash, hashed_length) of the first length bytes of a file."""
+    head = read_file_head(file, length)
+    return hashlib.sha1(head).digest(), len(head)
+
+
+# Cursor used when no --cursor name is given
+DEFAULT_CURSOR = "default"
+
+# Directory mtimes within this many ns of the index scan are not trusted
+SESSION_INDEX_SETTLE_NS = 1_000_000_000
+
+# Saved htail cursor: read position plus the identity of the file it belongs to
+Cursor = collections.namedtuple('Cursor', 'position dev ino size fingerprint fingerprint_length')
+
+
+def get_position_store_path() -> str:
+    """Return the path of the htail position database.
+    UBITOOL_HTAIL_DB overrides the default $XDG_STATE_HOME/ubitool/htail.sqlite3."""
+    if os.environ.get('UBITOOL_HTAIL_DB'):
+        return os.path.expanduser(os.environ['UBITOOL_HTAIL_DB'])
+    state_home = os.environ.get('XDG_STATE_HOME') or os.path.expanduser("~/.local/state")
+    return os.path.join(state_home, "ubitool", "htail.sqlite3")
+
+
+def _legacy_position_file(file: str) -> str:
+    """Return the path of the old per-file position sidecar (.FILE.htail)."""
+    file_dir = os.path.dirname(os.path.abspath(file))
+    file_name = os.path.basename(file)
+    return os.path.join(file_dir, f".{file_name}.htail")
+
+
+class PositionStore:
+    """Central store of htail read positions, shared by htail, shtail and stssend.
+    
+    Positions live in one SQLite database in WAL mode, keyed by the canonical
+    path of the file (symlinks resolved), instead of a .FILE.htail sidecar next
+    to every log. Each set() commits on its own unless it runs inside batch().
+    Old sidecar files are moved into the store the first time they are read.
+    
+    Along with the position, a cursor records the device, inode, size and a
+    fingerprint of the first FINGERPRINT_SIZE bytes of the file, so that a
+    truncated or rotated file can be told apart from the one that was read.
+    
+    Cursors are named, so independent readers of the same log (e.g. a person
+    running shtail and stssend) keep separate positions. A store reads and
+    writes the cursor it was opened with.
+    
+    The database also holds the index of tmux session logs per directory
+    (see find_session_log), which does not depend on the cursor, and per
+    cursor the log each tmux pane was last read from (see
+    resolve_session_rollover)."""
+    
+    SCHEMA_VERSION = 5
+    
+    def __init__(self, db_path: str = None, cursor: str = DEFAULT_CURSOR):
+        self.db_path = db_path or get_position_store_path()
+        self.cursor = cursor
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # Autocommit mode; batch() opens explicit transactions
+        self.connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._in_batch = False
+        self._lock_fd = None
+        self._migrate()
+    
+    def _migrate(self):
+        """Bring the schema up to SCHEMA_VERSION (tracked in PRAGMA user_version)."""
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with self.batch():
+            # Another process may have migrated while this one waited for the write lock
+            version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+            if version >= self.SCHEMA_VERSION:
+                return
+            if version < 1:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS positions ("
+                    "path TEXT PRIMARY KEY, "
+                    "position INTEGER NOT NULL, "
+                    "updated REAL NOT NULL)")
+            if version < 2:
+                for column in ("dev INTEGER", "ino INTEGER", "size INTEGER", "fingerprint BLOB", "fingerprint_length INTEGER"):
+                    self.connection.execute(f"ALTER TABLE positions ADD COLUMN {column}")
+            if version < 3:
+                # The primary key gains the cursor name, so the table is rebuilt
+                self.connection.execute(
+                    "CREATE TABLE positions_v3 ("
+                    "cursor TEXT NOT NULL, "
+                    "path TEXT NOT NULL, "
+                    "position INTEGER NOT NULL, "
+                    "updated REAL NOT NULL, "
+                    "dev INTEGER, ino INTEGER, size INTEGER, fingerprint BLOB, fingerprint_length INTEGER, "
+                    "PRIMARY KEY (cursor, path))")
+                self.connection.execute(
+                    "INSERT INTO positions_v3 SELECT ?, path, position, updated, dev, ino, size, fingerprint, fingerprint_length "
+                    "FROM positions", (DEFAULT_CURSOR,))
+                self.connection.execute("DROP TABLE positions")
+                self.connection.execute("ALTER TABLE positions_v3 RENAME TO positions")
+            if version < 4:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS session_log_dirs ("
+                    "directory TEXT PRIMARY KEY, "
+                    "mtime_ns INTEGER NOT NULL, "
+                    "scanned_ns INTEGER NOT NULL)")
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS session_logs ("
+                    "directory TEXT NOT NULL, "
+                    "session TEXT NOT NULL, "
+                    "window INTEGER NOT NULL, "
+                    "pane INTEGER NOT NULL, "
+                    "path TEXT NOT NULL, "
+                    "mtime_ns INTEGER NOT NULL, "
+                    "PRIMARY KEY (directory, session, window, pane))")
+            if version < 5:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS session_cursors ("
+                    "cursor TEXT NOT NULL, "
+                    "directory TEXT NOT NULL, "
+                    "session TEXT NOT NULL, "
+                    "window INTEGER NOT NULL, "
+                    "pane INTEGER NOT NULL, "
+                    "path TEXT NOT NULL, "
+                    "updated REAL NOT NULL, "
+                    "PRIMARY KEY (cursor, directory, session, window, pane))")
+            self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+    
+    @staticmethod
+    def key(file: str) -> str:
+        """Return the identity under which the position of a file is stored."""
+        return os.path.realpath(file)
+    
+    def get(self, file: str) -> int:
+        """Return the saved position of a file (0 if there is none)."""
+        cursor = self.get_cursor(file)
+        return cursor.position if cursor is not None else 0
+    
+    def get_cursor(self, file: str) -> Cursor:
+        """Return the saved cursor of a file, or None if there is none."""
+        query = "SELECT position, dev, ino, size, fingerprint, fingerprint_length FROM positions WHERE cursor = ? AND path = ?"
+        row = self.connection.execute(query, (self.cursor, self.key(file))).fetchone()
+        if row is None and self.cursor == DEFAULT_CURSOR and self._import_legacy(file):
+            row = self.connection.execute(query, (self.cursor, self.key(file))).fetchone()
+        return Cursor(*row) if row is not None else None
+    
+    def _import_legacy(self, file: str) -> bool:
+        """Move a .FILE.htail sidecar into the default cursor if one exists."""
+        position_file = _legacy_position_file(file)
+        if not os.path.exists(position_file):
+            return False
+        try:
+            with open(position_file, 'r') as f:
+                position = int(f.read().strip())
+        except (ValueError, IOError):
+            position = 0
+        self.set(file, position)
+        try:
+            os.remove(position_file)
+        except OSError:
+            pass
+        return True
+    
+    def set(self, file: str, position: int):
+        """Save the position of a file together with its current identity."""
+        st = os.stat(file)
+        fingerprint, fingerprint_length = file_fingerprint(file)
+        self.connection.execute(
+            "INSERT INTO positions (cursor, path, position, updated, dev, ino, size, fingerprint, fingerprint_length) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(cursor, path) DO UPDATE SET position = excluded.position, updated = excluded.updated, "
+            "dev = excluded.dev, ino = excluded.ino, size = excluded.size, "
+            "fingerprint = excluded.fingerprint, fingerprint_length = excluded.fingerprint_length",
+            (self.cursor, self.key(file), position, time.time(), st.st_dev, st.st_ino, st.st_size, fingerprint, fingerprint_length))
+    
+    def delete(self, file: str):
+        """Forget the position of a file, including a leftover sidecar."""
+        self.connection.execute("DELETE FROM positions WHERE cursor = ? AND path = ?", (self.cursor, self.key(file)))
+        position_file = _legacy_position_file(file)
+        if self.cursor == DEFAULT_CURSOR and os.path.exists(position_file):
+            os.remove(position_file)
+    
+    def list_cursors(self, file: str = None) -> list:
+        """Return (cursor_name, path, Cursor, updated) for every saved cursor,
+        or only for those of one file."""
+        query = "SELECT cursor, path, position, dev, ino, size, fingerprint, fingerprint_length, updated FROM positions"
+        if file is not None:
+            rows = self.connection.execute(query + " WHERE path = ? ORDER BY cursor", (self.key(file),))
+        else:
+            rows = self.connection.execute(query + " ORDER BY path, cursor")
+        return [(row[0], row[1], Cursor(*row[2:8]), row[8]) for row in rows]
+    
+    def get_session_logs(self, directory: str, mtime_ns: int, session: str = None) -> dict:
+        """Return the indexed session logs of a directory (or of one session in it),
+        or None if the index was built for another mtime of the directory."""
+        row = self.connection.execute("SELECT mtime_ns, scanned_ns FROM session_log_dirs WHERE directory = ?",
+                                      (directory,)).fetchone()
+        if row is None or row[0] != mtime_ns:
+            return None
+        if row[1] - row[0] < SESSION_INDEX_SETTLE_NS:
+            # Scanned right after a change: another change in the same
+            # timestamp tick would not have moved the mtime
+            return None
+        query = "SELECT session, window, pane, path, mtime_ns FROM session_logs WHERE directory = ?"
+        if session is not None:
+            rows = self.connection.execute(query + " AND session = ?", (directory, session))
+        else:
+            rows = self.connection.execute(query, (directory,))
+        return {(row[0], row[1], row[2]): (row[3], row[4]) for row in rows}
+    
+    def set_session_logs(self, directory: str, mtime_ns: int, scanned_ns: int, logs: dict):
+        """Replace the index of a directory with logs ({(session, window, pane): (path, mtime_ns)})."""
+        with self.batch():
+            self.connection.execute("DELETE FROM session_logs WHERE directory = ?", (directory,))
+            self.connection.executemany(
+                "INSERT INTO session_logs (directory, session, window, pane, path, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)",
+                [(directory, *key, path, file_mtime_ns) for key, (path, file_mtime_ns) in logs.items()])
+            self.connection.execute(
+                "INSERT INTO session_log_dirs (directory, mtime_ns, scanned_ns) VALUES (?, ?, ?) "
+                "ON CONFLICT(directory) DO UPDATE SET mtime_ns = excluded.mtime_ns, scanned_ns = excluded.scanned_ns",
+                (directory, mtime_ns, scanned_ns))
+    
+    def get_session_file(self, session_key: tuple) -> str:
+        """Return the log last read for a tmux pane ((directory, session, window, pane)), or None."""
+        row = self.connection.execute(
+            "SELECT path FROM session_cursors WHERE cursor = ? AND directory = ? AND session = ? AND window = ? AND pane = ?",
+            (self.cursor, *session_key)).fetchone()
+        return row[0] if row is not None else None
+    
+    def set_session_file(self, session_key: tuple, file: str):
+        """Remember the log a tmux pane is now read from."""
+        self.connection.execute(
+            "INSERT INTO session_cursors (cursor, directory, session, window, pane, path, updated) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(cursor, directory, session, window, pane) DO UPDATE SET path = excluded.path, updated = excluded.updated",
+            (self.cursor, *session_key, file, time.time()))
+    
+    @contextlib.contextmanager
+    def batch(self):
+        """Group updates into one transaction; nested calls join the outer one."""
+        if self._in_batch:
+            yield self
+            return
+        self._in_batch = True
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        else:
+            self.connection.execute("COMMIT")
+        finally:
+            self._in_batch = False
+    
+    def compare_and_set(self, file: str, expected: int, position: int) -> bool:
+        """Save a position only if the stored one is still expected (None: no cursor yet).
+        Returns False, and changes nothing, if another reader moved the cursor."""
+        with self.batch():
+            # BEGIN IMMEDIATE holds the write lock from the check to the update
+            row = self.connection.execute("SELECT position FROM positions WHERE cursor = ? AND path = ?",
+                                          (self.cursor, self.key(file))).fetchone()
+            if (row[0] if row is not None else None) != expected:
+                return False
+            self.set(file, position)
+            return True
+    
+    @contextlib.contextmanager
+    def lock(self, file: str):
+        """Hold an exclusive lock on the cursor of a file across processes.
+        
+        Reading the saved position, showing the data after it and saving the
+        new position happen under this lock, so concurrent readers of one
+        cursor split the data between them instead of showing it twice. The
+        lock is a byte-range lock (fcntl, or msvcrt on Windows) on one byte
+        of the .lock file next to the database, picked by a hash of the
+        cursor name and path."""
+        digest = hashlib.sha1(f"{self.cursor}\0{self.key(file)}".encode('utf-8', 'surrogateescape')).digest()
+        offset = int.from_bytes(digest[:4], 'big') & 0x7FFFFFFF
+        if self._lock_fd is None:
+            # One descriptor for all locks: closing any descriptor of the file
+            # would drop every fcntl lock this process holds on it
+            self._lock_fd = os.open(self.db_path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        _lock_byte(self._lock_fd, offset)
+        try:
+            yield self
+        finally:
+            _unlock_byte(self._lock_fd, offset)
+    
+    def close(self):
+        self.connection.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+def _lock_byte(fd: int, offset: int):
+    """Wait for an exclusive lock on one byte of a file (see PositionStore.lock)."""
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset)
+    elif msvcrt is not None:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass  # LK_LOCK gives up after 10 attempts; keep waiting
+    # Without either, readers of one cursor are not serialized
+
+
+def _unlock_byte(fd: int, offset: int):
+    if fcntl is not None:
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+    elif msvcrt is not None:
+        os.lseek(fd, offset, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+_position_stores = {}
+
+
+def get_position_store(cursor: str = DEFAULT_CURSOR) -> PositionStore:
+    """Return the process-wide position store of a cursor, opening it on first use."""
+    if cursor not in _position_stores:
+        _position_stores[cursor] = PositionStore(cursor=cursor)
+    return _position_stores[cursor]
+
+
+def _find_rotated_file(file: str, cursor: Cursor) -> str:
+    """Return the file that now holds the data a cursor was saved for, or None.
+    Rename rotation keeps the inode (app.log -> app.log.1); copytruncate and
+    compression keep the content, found through the fingerprint."""
+    directory = os.path.dirname(os.path.abspath(file))
+    name = os.path.basename(file)
+    candidates = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name == name or not entry.name.startswith(name) or not entry.is_file():
+                continue
+            st = entry.stat()
+            if (st.st_dev, st.st_ino) == (cursor.dev, cursor.ino):
+                return entry.path
+            candidates.append((st.st_mtime, entry.path))
+    
+    if not cursor.fingerprint_length:
+        return None
+    # The most recently rotated file is the likeliest one
+    for _, path in sorted(candidates, reverse=True):
+        try:
+            fingerprint, length = file_fingerprint(path, cursor.fingerprint_length)
+        except (OSError, EOFError, zlib.error, lzma.LZMAError):
+            continue
+        if (fingerprint, length) == (cursor.fingerprint, cursor.fingerprint_length):
+            return path
+    return None
+
+
+def resolve_position(store: PositionStore, file: str) -> tuple[int, tuple]:
+    """Return (last_position, rotated) for the file currently at a path.
+    
+    The saved cursor is checked against the file: if it is still the same
+    file (same inode, not shrunk, same fingerprint) reading resumes at the
+    saved position. Otherwise the file was truncated or rotated and reading
+    starts at 0; rotated is then (old_file, position) for the file holding the
+    rest of the data the cursor was saved for, or None if it is gone."""
+    return check_cursor(file, store.get_cursor(file))
+
+
+def check_cursor(file: str, cursor: Cursor) -> tuple[int, tuple]:
+    """Check a saved cursor (or None) against a file; see resolve_position.
+    Only the file system is touched, so this may run in worker threads."""
+    if cursor is None:
+        return 0, None
+    if cursor.ino is None:
+        return cursor.position, None  # Saved before file identities were recorded
+    
+    st = os.stat(file)
+    if (st.st_dev, st.st_ino) == (cursor.dev, cursor.ino) and st.st_size >= cursor.size:
+        if file_fingerprint(file, cursor.fingerprint_length) == (cursor.fingerprint, cursor.fingerprint_length):
+            return cursor.position, None
+    
+    rotated_file = _find_rotated_file(file, cursor)
+    return 0, (rotated_file, cursor.position) if rotated_file is not None else None
@@ -1,26 +1,69 @@
 """Shtail command implementation for ubitool."""
 
 import os
-import glob as glob_module
 import typer
-from .utils import execute_htail_logic
+from .htail import execute_htail_logic, execute_htail_files, find_session_logs, parse_pane_selector, session_log_pattern, pane_label, session_cursor_key, DEFAULT_SESSION_LOG_PATH, HTAIL_JOBS
+from .position_store import DEFAULT_CURSOR
+from .tmux_session import follow_control_output, SESSION_BACKENDS, SESSION_CLIENTS
 
 
 def shtail_command(
-    path: str = typer.Argument("~/Workspace/log/tmux", help="Directory containing tmux log files."),
+    path: str = typer.Argument(DEFAULT_SESSION_LOG_PATH, help="Directory containing tmux log files."),
     target_session: str = typer.Option(..., "-t", "--target-session", help="Target tmux session name."),
+    window: str = typer.Option("0", "-w", "--window", help="Window index of the pane(s) to read, or 'all'."),
+    pane: str = typer.Option("0", "-p", "--pane", help="Pane index within the window(s), or 'all'."),
     lines: int = typer.Option(None, "-n", "--lines", help="Maximum number of new lines to display."),
     bytes_count: int = typer.Option(None, "-c", "--bytes", help="Maximum number of new bytes to display. (Overrides -n if both specified)"),
     reset: bool = typer.Option(False, "--reset", help="Reset the saved position and read from the beginning."),
     last: bool = typer.Option(False, "--last", help="Mark current end of file as read (skip to end without displaying)."),
-    keep: bool = typer.Option(False, "--keep", help="Do not update last read position.")
+    keep: bool = typer.Option(False, "--keep", help="Do not update last read position."),
+    cursor: str = typer.Option(DEFAULT_CURSOR, "--cursor", help="Name of the read position to use (see htail --cursor)."),
+    follow: bool = typer.Option(False, "-f", "--follow", help="Keep running and print new content of the selected panes as it is appended."),
+    jobs: int = typer.Option(HTAIL_JOBS, "-j", "--jobs", help="Number of pane logs read at the same time when several panes are selected."),
+    backend: str = typer.Option("file", "--backend", help="Where output is read from: 'file' (pipe-pane logs in PATH), 'control' (live output from the tmux server in control mode) or 'capture' (new lines of successive capture-pane snapshots, for sessions without logging). 'control' and 'capture' imply --follow and fall back to 'file'."),
+    normalize: bool = typer.Option(False, "--normalize", help="Remove terminal escape sequences and apply \\r and backspace redraws, so the output reads as plain text.")
 ):
     """Execute htail on the latest tmux session log file.
     
     Finds and reads the latest log file matching the pattern:
-    PATH/session_<target-session>_window_0_pane_0_*.log"""
+    PATH/session_<target-session>_window_<window>_pane_<pane>_*.log
+    
+    With --window/--pane 'all', every selected pane is read in one run; the
+    output is labeled per pane (==> SESSION:WINDOW.PANE <==) and each pane
+    log keeps its own read position.
+    
+    When tmux logging of a pane restarts into a new log file, the unread
+    rest of the previous log is shown first; with --follow the new file is
+    picked up as soon as it is created.
+    
+    With --backend control the output is streamed straight from the tmux
+    server (tmux -C) as it is produced, without log files; with --backend
+    capture it is recovered from capture-pane snapshots, so the session
+    needs no logging set up. Both leave the saved read positions alone."""
     
     try:
+        try:
+            window_index = parse_pane_selector(window, "window")
+            pane_index = parse_pane_selector(pane, "pane")
+        except ValueError as e:
+            print(f"Error: {e}")
+            raise typer.Exit(1)
+        
+        if backend not in SESSION_BACKENDS:
+            print(f"Error: Unknown backend '{backend}' (expected one of: {', '.join(SESSION_BACKENDS)}).")
+            raise typer.Exit(1)
+        
+        if backend in SESSION_CLIENTS:
+            try:
+                client = SESSION_CLIENTS[backend](target_session, window_index, pane_index)
+            except (OSError, RuntimeError) as e:
+                print(f"Warning: {e}; reading the log files instead.")
+                follow = True
+            else:
+                with client:
+                    follow_control_output(client, labeled=window_index is None or pane_index is None, normalize=normalize)
+                return
+        
         # Expand tilde to home directory
         path = os.path.expanduser(path)
         
@@ -33,21 +76,22 @@ def shtail_command(
             print(f"Error: '{path}' is not a directory.")
             raise typer.Exit(1)
         
-        # Build the pattern for tmux log files
-        pattern = os.path.join(path, f"session_{target_session}_window_0_pane_0_*.log")
+        # Served from the session log index instead of scanning the directory
+        logs = find_session_logs(target_session, path, window_index, pane_index)
         
-        # Find matching log files
-        log_files = glob_module.glob(pattern)
-        
-        if not log_files:
+        if not logs:
+            pattern = os.path.join(path, session_log_pattern(target_session, window_index, pane_index))
             print(f"Error: No log files found matching pattern: {pattern}")
             raise typer.Exit(1)
         
-        # Sort by modification time and get the latest file
-        latest_file = max(log_files, key=os.path.getmtime)
-        
-        # Reuse htail logic by calling the same functions
-        execute_htail_logic(latest_file, lines, bytes_count, reset, last, keep)
+        if window_index is not None and pane_index is not None:
+            # Reuse htail logic by calling the same functions
+            execute_htail_logic(logs[0][2], lines, bytes_count, reset, last, keep, cursor=cursor, follow=follow, normalize=normalize,
+                                session_key=session_cursor_key(target_session, path, window_index, pane_index))
+        else:
+            labels = {log_file: pane_label(target_session, w, p) for w, p, log_file in logs}
+            session_keys = {log_file: session_cursor_key(target_session, path, w, p) for w, p, log_file in logs}
+            execute_htail_files(list(labels), lines, bytes_count, reset, last, keep, cursor=cursor, jobs=jobs, follow=follow, labels=labels, normalize=normalize, session_keys=session_keys)
         
     except Exception as e:
         print(f"Error in shtail: {e}")
@@ -1,9 +1,13 @@
 """Stssend command implementation for ubitool."""
 
+import os
 import subprocess
 import time
 import typer
-from .utils import get_htail_content_for_session
+from .htail import HtailReader, find_session_logs, parse_pane_selector, pane_label, session_cursor_key
+from .file_watcher import FileWatcher
+from .terminal import normalize_terminal_output
+from .tmux_session import TmuxControlClient, TmuxPaneReader, SESSION_BACKENDS, SESSION_CLIENTS
 
 
 def stssend_command(
@@ -13,8 +17,13 @@ def stssend_command(
     retry: int = typer.Option(10, "-r", "--retry", help="Maximum number of retries."),
     retry_interval: int = typer.Option(1, "--retry-interval", help="Interval between retries in seconds."),
     timeout: int = typer.Option(30, "--timeout", help="Timeout for each command execution in seconds."),
-    output_path: str = typer.Option("~/Workspace/log/tmux", "-o", "--output-path", help="Directory containing tmux log files. Finds and reads the latest log file matching the pattern: PATH/session_<target-session>_window_0_pane_0_*.log"),
-    cancel_key: list[str] = typer.Option([], "-c", "--cancel-key", help="Key sent before every retry to cancel the previous one.")
+    output_path: str = typer.Option("~/Workspace/log/tmux", "-o", "--output-path", help="Directory containing tmux log files. Finds and reads the latest log file matching the pattern: PATH/session_<target-session>_window_<window>_pane_<pane>_*.log"),
+    window: str = typer.Option(None, "-w", "--window", help="Window index whose output is checked, or 'all'; keys are sent to this window when it is a number. [default: 0]"),
+    pane: str = typer.Option(None, "-p", "--pane", help="Pane index whose output is checked, or 'all'; keys are sent to this pane when it is a number. [default: 0]"),
+    cancel_key: list[str] = typer.Option([], "-c", "--cancel-key", help="Key sent before every retry to cancel the previous one."),
+    cursor: str = typer.Option("stssend", "--cursor", help="Name of the read position used on the session log, kept apart from the one shtail uses by default."),
+    backend: str = typer.Option("file", "--backend", help="Where output is read from: 'file' (pipe-pane logs in --output-path), 'control' (live output from the tmux server in control mode) or 'capture' (capture-pane snapshots, works without logging); falls back to 'file'."),
+    normalize: bool = typer.Option(False, "--normalize", help="Match --expect against the output as shown on screen: escape sequences removed, \\r and backspace redraws applied.")
 ):
     """Retry sending keys to tmux session (strict ssend).
     
@@ -23,120 +32,241 @@ def stssend_command(
     
     Output is get with the shtail command logic
     
-    After send cancel key and before resend KEYS, output should be cleared with htail command logic."""
+    After send cancel key and before resend KEYS, output should be cleared with htail command logic.
+    
+    With --window/--pane 'all' the output of every selected pane is checked;
+    each pane log keeps its own read position.
+    
+    With --backend control the output is taken straight from the tmux server
+    (tmux -C) and checked as soon as it arrives; with --backend capture it is
+    taken from capture-pane snapshots. Neither needs log files."""
 
-    # Clear output before sending keys
-    get_htail_content_for_session(target_session, lines=1, keep=False, output_path=output_path) # Clear output
+    try:
+        window_index = parse_pane_selector(window, "window")
+        pane_index = parse_pane_selector(pane, "pane")
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise typer.Exit(1)
+    target = _tmux_target(target_session, window, pane, window_index, pane_index)
+
+    if backend not in SESSION_BACKENDS:
+        print(f"Error: Unknown backend '{backend}' (expected one of: {', '.join(SESSION_BACKENDS)}).")
+        raise typer.Exit(1)
 
-    for attempt in range(1, retry + 1):
+    client = None
+    if backend in SESSION_CLIENTS:
         try:
-            print(f"Attempt {attempt}/{retry}: Sending keys to session '{target_session}'...")
-            
-            # Send keys using ssend logic
-            command = ["tmux", "send-keys", "-t", target_session] + keys
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                timeout=30  # tmux send-keys should be quick
-            )
-            
-            if result.returncode != 0:
-                print(f"Error: Failed to send keys to session '{target_session}'")
-                if result.stderr:
-                    print(f"Error details: {result.stderr.strip()}")
+            client = SESSION_CLIENTS[backend](target_session, window_index, pane_index)
+        except (OSError, RuntimeError) as e:
+            print(f"Warning: {e}; reading the log files instead.")
+
+    # The pane logs stay open for the whole run; each poll reads only what was appended
+    readers = _open_session_readers({}, target_session, output_path, cursor, window_index, pane_index, client)
+    watcher = None
+    watched = {}
+    log_directory = os.path.abspath(os.path.expanduser(output_path))
+    if client is None:
+        # Wakes up on new output, and on a new log file when tmux logging restarts
+        watcher = FileWatcher()
+        watcher.add_directory(log_directory)
+        _watch_readers(watcher, readers, watched)
+
+    # Clear output before sending keys
+    recent_output = _clear_output(readers)
+
+    try:
+        for attempt in range(1, retry + 1):
+            try:
+                print(f"Attempt {attempt}/{retry}: Sending keys to session '{target_session}'...")
+                
+                # Send keys using ssend logic
+                command = ["tmux", "send-keys", "-t", target] + keys
+                result = subprocess.run(
+                    command,
+                    capture_output=True,
+                    text=True,
+                    timeout=30  # tmux send-keys should be quick
+                )
+                
+                if result.returncode != 0:
+                    print(f"Error: Failed to send keys to session '{target}'")
+                    if result.stderr:
+                        print(f"Error details: {result.stderr.strip()}")
+                    if attempt < retry:
+                        # Send cancel keys if specified (before retry)
+                        if cancel_key:
+                            print(f"Sending cancel keys: {' '.join(cancel_key)}")
+                            for cancel_k in cancel_key:
+                                cancel_command = ["tmux", "send-keys", "-t", target, cancel_k]
+                                subprocess.run(cancel_command, capture_output=True)
+                                time.sleep(0.1)  # Short delay between cancel keys
+                        
+                        print(f"Retrying in {retry_interval} second(s)...")
+                        time.sleep(retry_interval)
+                    continue
+                
+                # Wait for expected output with timeout
+                start_time = time.time()
+                found_expected = False
+                
+                while time.time() - start_time < timeout:
+                    # Wait a moment before checking output (control/capture wake up as soon as output arrives)
+                    if client is not None:
+                        client.poll(1.0)
+                        readers = _open_session_readers(readers, target_session, output_path, cursor, window_index, pane_index, client)
+                    elif log_directory in watcher.wait(1.0):
+                        # Only a new entry in the log directory can be a new pane log
+                        for reader in readers.values():
+                            reader.check_session_rollover()
+                        readers = _open_session_readers(readers, target_session, output_path, cursor, window_index, pane_index, client)
+                    
+                    # Get output using htail logic (last 50 lines per pane since the output was cleared)
+                    for label, reader in readers.items():
+                        recent_output[label] = _last_lines(recent_output.get(label, b'') + reader.read(), 50)
+                    if watcher is not None:
+                        _watch_readers(watcher, readers, watched)
+                    
+                    # Check if expected string is in the output of any pane
+                    for label, output in recent_output.items():
+                        if normalize:
+                            output = normalize_terminal_output(output)
+                        output_text = output.decode('utf-8', errors='replace')
+                        if output_text and expect in output_text:
+                            print(f"Success: Expected string '{expect}' found in output after {attempt} attempt(s)")
+                            # Show the relevant output
+                            if output_text.strip():
+                                print("Recent output:" if len(readers) == 1 else f"Recent output ({label}):")
+                                print(output_text.strip())
+                            found_expected = True
+                            break
+                    if found_expected:
+                        break
+                
+                if found_expected:
+                    return
+                
+                # If we reach here, timeout occurred without finding expected string
+                print(f"Expected string '{expect}' not found within {timeout} seconds")
                 if attempt < retry:
                     # Send cancel keys if specified (before retry)
                     if cancel_key:
                         print(f"Sending cancel keys: {' '.join(cancel_key)}")
                         for cancel_k in cancel_key:
-                            cancel_command = ["tmux", "send-keys", "-t", target_session, cancel_k]
+                            cancel_command = ["tmux", "send-keys", "-t", target, cancel_k]
                             subprocess.run(cancel_command, capture_output=True)
                             time.sleep(0.1)  # Short delay between cancel keys
+                        
+                        # Clear output after sending cancel keys
+                        time.sleep(0.5)  # Wait for cancel keys to take effect
+                        recent_output = _clear_output(readers)
                     
                     print(f"Retrying in {retry_interval} second(s)...")
                     time.sleep(retry_interval)
-                continue
-            
-            # Wait for expected output with timeout
-            start_time = time.time()
-            found_expected = False
-            
-            while time.time() - start_time < timeout:
-                # Wait a moment before checking output
-                time.sleep(1.0)
-                
-                # Get output using htail logic
-                recent_output = get_htail_content_for_session(target_session, lines=50, keep=True, output_path=output_path)
-                
-                # Check if expected string is in the output
-                if recent_output and expect in recent_output:
-                    print(f"Success: Expected string '{expect}' found in output after {attempt} attempt(s)")
-                    # Show the relevant output
-                    if recent_output.strip():
-                        print("Recent output:")
-                        print(recent_output.strip())
-                    found_expected = True
-                    break
-            
-            if found_expected:
-                return
-            
-            # If we reach here, timeout occurred without finding expected string
-            print(f"Expected string '{expect}' not found within {timeout} seconds")
-            if attempt < retry:
-                # Send cancel keys if specified (before retry)
-                if cancel_key:
-                    print(f"Sending cancel keys: {' '.join(cancel_key)}")
-                    for cancel_k in cancel_key:
-                        cancel_command = ["tmux", "send-keys", "-t", target_session, cancel_k]
-                        subprocess.run(cancel_command, capture_output=True)
-                        time.sleep(0.1)  # Short delay between cancel keys
                     
-                    # Clear output after sending cancel keys
-                    time.sleep(0.5)  # Wait for cancel keys to take effect
-                    get_htail_content_for_session(target_session, lines=1, keep=False, output_path=output_path)
-                
-                print(f"Retrying in {retry_interval} second(s)...")
-                time.sleep(retry_interval)
-                
-        except subprocess.TimeoutExpired:
-            print(f"Attempt {attempt}: tmux send-keys command timed out")
-            if attempt < retry:
-                # Send cancel keys if specified (before retry)
-                if cancel_key:
-                    print(f"Sending cancel keys: {' '.join(cancel_key)}")
-                    for cancel_k in cancel_key:
-                        cancel_command = ["tmux", "send-keys", "-t", target_session, cancel_k]
-                        subprocess.run(cancel_command, capture_output=True)
-                        time.sleep(0.1)  # Short delay between cancel keys
+            except subprocess.TimeoutExpired:
+                print(f"Attempt {attempt}: tmux send-keys command timed out")
+                if attempt < retry:
+                    # Send cancel keys if specified (before retry)
+                    if cancel_key:
+                        print(f"Sending cancel keys: {' '.join(cancel_key)}")
+                        for cancel_k in cancel_key:
+                            cancel_command = ["tmux", "send-keys", "-t", target, cancel_k]
+                            subprocess.run(cancel_command, capture_output=True)
+                            time.sleep(0.1)  # Short delay between cancel keys
+                        
+                        # Clear output after sending cancel keys
+                        time.sleep(0.5)  # Wait for cancel keys to take effect
+                        recent_output = _clear_output(readers)
                     
-                    # Clear output after sending cancel keys
-                    time.sleep(0.5)  # Wait for cancel keys to take effect
-                    get_htail_content_for_session(target_session, lines=1, keep=False, output_path=output_path)
-                
-                print(f"Retrying in {retry_interval} second(s)...")
-                time.sleep(retry_interval)
-        except FileNotFoundError:
-            print("Error: tmux command not found. Please make sure tmux is installed.")
-            raise typer.Exit(1)
-        except Exception as e:
-            print(f"Attempt {attempt}: Error executing command: {e}")
-            if attempt < retry:
-                # Send cancel keys if specified (before retry)
-                if cancel_key:
-                    print(f"Sending cancel keys: {' '.join(cancel_key)}")
-                    for cancel_k in cancel_key:
-                        cancel_command = ["tmux", "send-keys", "-t", target_session, cancel_k]
-                        subprocess.run(cancel_command, capture_output=True)
-                        time.sleep(0.1)  # Short delay between cancel keys
+                    print(f"Retrying in {retry_interval} second(s)...")
+                    time.sleep(retry_interval)
+            except FileNotFoundError:
+                print("Error: tmux command not found. Please make sure tmux is installed.")
+                raise typer.Exit(1)
+            except Exception as e:
+                print(f"Attempt {attempt}: Error executing command: {e}")
+                if attempt < retry:
+                    # Send cancel keys if specified (before retry)
+                    if cancel_key:
+                        print(f"Sending cancel keys: {' '.join(cancel_key)}")
+                        for cancel_k in cancel_key:
+                            cancel_command = ["tmux", "send-keys", "-t", target, cancel_k]
+                            subprocess.run(cancel_command, capture_output=True)
+                            time.sleep(0.1)  # Short delay between cancel keys
+                        
+                        # Clear output after sending cancel keys
+                        time.sleep(0.5)  # Wait for cancel keys to take effect
+                        recent_output = _clear_output(readers)
                     
-                    # Clear output after sending cancel keys
-                    time.sleep(0.5)  # Wait for cancel keys to take effect
-                    get_htail_content_for_session(target_session, lines=1, keep=False, output_path=output_path)
-                
-                print(f"Retrying in {retry_interval} second(s)...")
-                time.sleep(retry_interval)
+                    print(f"Retrying in {retry_interval} second(s)...")
+                    time.sleep(retry_interval)
+        
+        print(f"Failed: Expected string '{expect}' not found after {retry} attempts")
+        raise typer.Exit(1)
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if client is not None:
+            client.close()
+
+
+def _tmux_target(target_session: str, window: str, pane: str, window_index: int, pane_index: int) -> str:
+    """Return the tmux target keys are sent to: the session, unless a window
+    (and pane) was selected by number."""
+    if window is None or window_index is None:
+        return target_session
+    if pane is None or pane_index is None:
+        return f"{target_session}:{window_index}"
+    return f"{target_session}:{window_index}.{pane_index}"
+
+
+def _open_session_readers(readers: dict, target_session: str, output_path: str, cursor: str, window: int, pane: int, client: TmuxControlClient = None) -> dict:
+    """Add an HtailReader for every selected pane log that has none yet; returns
+    the readers by pane label. Panes whose log does not exist yet are retried
+    on the next call. With a control-mode or capture-pane client, every
+    selected pane is read from it instead."""
+    if client is not None:
+        for w, p in client.panes():
+            readers.setdefault(pane_label(target_session, w, p), TmuxPaneReader(client, w, p))
+        return readers
     
-    print(f"Failed: Expected string '{expect}' not found after {retry} attempts")
-    raise typer.Exit(1)
\ No newline at end of file
+    if window is not None and pane is not None and pane_label(target_session, window, pane) in readers:
+        return readers  # The one selected pane is already open; no need to look up its log
+    
+    for w, p, log_file in find_session_logs(target_session, output_path, window, pane):
+        label = pane_label(target_session, w, p)
+        if label in readers:
+            continue
+        try:
+            readers[label] = HtailReader(log_file, cursor=cursor, session_key=session_cursor_key(target_session, output_path, w, p))
+        except Exception as e:
+            print(f"Error getting content for session '{target_session}': {e}")
+    return readers
+
+
+def _watch_readers(watcher: FileWatcher, readers: dict, watched: dict):
+    """Watch the log of every reader that is new or has moved on to another
+    file; watched maps labels to the (path, inode) already registered."""
+    for label, reader in readers.items():
+        current = (reader.file, os.fstat(reader.fd).st_ino)
+        if watched.get(label) != current:
+            watcher.add(reader.file)
+            watched[label] = current
+
+
+def _clear_output(readers: dict) -> dict:
+    """Mark the output of every pane as read and save the positions; returns the emptied output buffers."""
+    for reader in readers.values():
+        reader.skip_to_end()
+        reader.commit()
+    return {}
+
+
+def _last_lines(data: bytes, lines: int) -> bytes:
+    """Return the last lines of data, as htail -n would show them."""
+    cut = len(data) - 1 if data.endswith(b'\n') else len(data)
+    for _ in range(lines):
+        cut = data.rfind(b'\n', 0, cut)
+        if cut < 0:
+            return data
+    return data[cut + 1:]
\ No newline at end of file
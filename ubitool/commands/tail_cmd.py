@@ -1,71 +1,328 @@
 """Tail command implementation for ubitool."""
 
 import os
+import lzma
+import zlib
+import heapq
+import codecs
+import collections
 import typer
+from .utils import find_last_lines_offset, find_time_offset, compile_timestamp_parser, parse_time_argument, write_file_range, write_chunks, silence_stdout
+from .utils import compile_grep_pattern, filter_lines, iter_filtered_chunks, find_last_matching_lines, iter_file_range, LineIndex
+from .compressed import is_compressed_file, load_compressed_index, iter_compressed_range, find_compressed_last_lines_offset
+from .file_watcher import FileWatcher
 
 
 def tail_command(
-    file: str = typer.Argument(..., help="Path to the file to read."),
+    files: list[str] = typer.Argument(..., help="Paths to the files to read."),
     lines: int = typer.Option(None, "-n", "--lines", help="Number of lines to display from the end of the file."),
-    bytes_count: int = typer.Option(None, "-c", "--bytes", help="Number of bytes to display from the end of the file. (Overrides -n if both specified)")
+    bytes_count: int = typer.Option(None, "-c", "--bytes", help="Number of bytes to display from the end of the file. (Overrides -n if both specified)"),
+    follow: bool = typer.Option(False, "-f", "--follow", help="Output appended data as the file grows."),
+    follow_name: bool = typer.Option(False, "-F", help="Like --follow, but reopen the file when it is replaced or recreated."),
+    sleep_interval: float = typer.Option(1.0, "-s", "--sleep-interval", help="Seconds between checks when inotify is not available."),
+    quiet: bool = typer.Option(False, "-q", "--quiet", help="Never print headers giving file names."),
+    merge: bool = typer.Option(False, "--merge", help="Interleave the lines of all files in timestamp order instead of printing each file separately."),
+    time_format: str = typer.Option(None, "--time-format", help="strptime format of the timestamp at the start of each line (used by --merge, --since and --until). [default: %Y-%m-%d %H:%M:%S]"),
+    since: str = typer.Option(None, "--since", help="Show lines with timestamps at or after TIME (e.g. '5m', '2h', '2025-01-01 10:00:00')."),
+    until: str = typer.Option(None, "--until", help="Show lines with timestamps at or before TIME."),
+    line_range: str = typer.Option(None, "--range", help="Show lines START:END (1-based, inclusive; either side may be omitted) using a sidecar line index (.FILE.lidx)."),
+    grep: str = typer.Option(None, "--grep", help="Only show lines matching this regular expression (with -n, the last N matching lines).")
 ):
-    """Print the last part of a file."""
+    """Print the last part of a file.
     
-    # Check if file exists
-    if not os.path.exists(file):
-        print(f"Warning: File '{file}' does not exist.")
-        return
+    With --since/--until the lines of a time window are shown; the window is
+    located by binary search, so the log must be ordered by timestamp.
+    -n/-c then limit the output to the end of the window.
+    
+    With --range the lines are located through a sampled line-offset index
+    that is kept next to the file and extended as the file grows."""
+    
+    windowed = since is not None or until is not None or line_range is not None
     
     # Set default values if neither option is specified
-    if lines is None and bytes_count is None:
+    if lines is None and bytes_count is None and not windowed:
         lines = 10  # Default to 10 lines
     
+    if bytes_count is not None and bytes_count <= 0:
+        print("Warning: Number of bytes must be greater than 0.")
+        return
+    
+    if bytes_count is None and lines is not None and lines <= 0:
+        print("Warning: Number of lines must be greater than 0.")
+        return
+    
     try:
-        if bytes_count is not None:
-            # Read the file and get the last N bytes
-            if bytes_count <= 0:
-                print("Warning: Number of bytes must be greater than 0.")
-                return
+        parse_timestamp = compile_timestamp_parser(time_format) if merge or windowed else None
+        since_time = parse_time_argument(since, time_format) if since is not None else None
+        until_time = parse_time_argument(until, time_format) if until is not None else None
+        first_line, last_line = _parse_line_range(line_range) if line_range is not None else (None, None)
+        regex = compile_grep_pattern(grep) if grep is not None else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        raise typer.Exit(1)
+    
+    show_headers = len(files) > 1 and not quiet and not merge
+    followed = []
+    merge_sources = []
+    headers_printed = 0
+    try:
+        for file in files:
+            # Check if file exists
+            if not os.path.exists(file):
+                if follow_name:
+                    # -F keeps retrying until the file appears
+                    print(f"Warning: File '{file}' does not exist, waiting for it to appear.")
+                    followed.append(_FollowedFile(file, None, 0, regex))
+                else:
+                    print(f"Warning: File '{file}' does not exist.")
+                continue
             
-            with open(file, 'rb') as f:
-                f.seek(0, 2)  # Go to end of file
-                file_size = f.tell()
-                
-                if file_size == 0:
-                    return
+            if is_compressed_file(file):
+                # Rotated logs are read through their seek index and never followed
+                if windowed:
+                    print(f"Warning: --since/--until/--range is not supported for compressed file '{file}'.")
+                    continue
+                try:
+                    chunks = _compressed_tail_chunks(file, lines, bytes_count, regex)
+                except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError) as e:
+                    print(f"Error reading file '{file}': {e}")
+                    continue
                 
-                # Read from the end
-                start_pos = max(0, file_size - bytes_count)
-                f.seek(start_pos)
-                content = f.read(bytes_count)
+                if merge:
+                    merge_sources.append(b''.join(chunks))
+                    continue
                 
-                # Print as text, handling encoding
-                try:
-                    print(content.decode('utf-8'), end='')
-                except UnicodeDecodeError:
-                    print(content.decode('utf-8', errors='replace'), end='')
-        else:
-            # Read the file and get the last N lines
-            if lines <= 0:
-                print("Warning: Number of lines must be greater than 0.")
-                return
-            
-            # Read as binary first to avoid encoding errors  
-            with open(file, 'rb') as f:
-                content = f.read()
+                if show_headers:
+                    _print_header(file, first=headers_printed == 0)
+                    headers_printed += 1
+                write_chunks(chunks)
+                continue
             
-            # Decode with error handling
             try:
-                text_content = content.decode('utf-8')
-            except UnicodeDecodeError:
-                text_content = content.decode('utf-8', errors='replace')
+                f = open(file, 'rb')
+            except OSError as e:
+                print(f"Error reading file '{file}': {e}")
+                continue
+            item = _FollowedFile(file, f, 0, regex)
+            followed.append(item)
+            
+            f.seek(0, 2)  # Go to end of file
+            file_size = f.tell()
+            
+            # Locate the time window by binary search over file offsets
+            window_start, window_end = 0, file_size
+            if line_range is not None:
+                index = LineIndex.open(file, f)
+                if first_line is not None:
+                    window_start = index.line_offset(f, first_line - 1)
+                if last_line is not None:
+                    window_end = max(window_start, index.line_offset(f, last_line))
+            if since_time is not None:
+                window_start = max(window_start, find_time_offset(f, since_time, parse_timestamp, 0, window_end))
+            if until_time is not None:
+                window_end = find_time_offset(f, until_time, parse_timestamp, window_start, window_end, inclusive=False)
             
-            file_lines = text_content.splitlines(keepends=True)
-            last_lines = file_lines[-lines:] if len(file_lines) >= lines else file_lines
+            item.position = file_size
             
-            # Output the lines
-            for line in last_lines:
-                print(line, end='')  # Don't add extra newline since lines already have them
+            if regex is not None and bytes_count is None and lines is not None:
+                # Scan backward until the last N matching lines are found
+                chunks = find_last_matching_lines(f, regex, lines, window_start, window_end)
+            else:
+                if bytes_count is not None:
+                    # Read the last N bytes
+                    start_pos = max(window_start, window_end - bytes_count)
+                elif lines is not None:
+                    # Only the blocks holding the last N lines are read
+                    start_pos = find_last_lines_offset(f, lines, start=window_start, end=window_end)
+                else:
+                    start_pos = window_start
+                
+                # Lines are filtered as raw bytes; only matches ever get decoded
+                chunks = iter_file_range(f, start_pos, window_end)
+                if regex is not None:
+                    chunks = iter_filtered_chunks(chunks, regex)
+            
+            if merge:
+                merge_sources.append(b''.join(chunks))
+                continue
+            
+            if show_headers:
+                _print_header(file, first=headers_printed == 0)
+                headers_printed += 1
             
+            if regex is None:
+                # Bytes go straight to a file or pipe; only a terminal gets decoded text
+                write_file_range(f, start_pos, window_end)
+            else:
+                write_chunks(chunks)
+        
+        if merge:
+            _print_merged(merge_sources, parse_timestamp)
+        
+        if (follow or follow_name) and followed:
+            _follow_files(followed, follow_name, sleep_interval, show_headers=len(files) > 1 and not quiet)
+    
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        silence_stdout()
     except Exception as e:
-        print(f"Error reading file '{file}': {e}")
\ No newline at end of file
+        print(f"Error reading files: {e}")
+    finally:
+        for item in followed:
+            if item.f is not None:
+                item.f.close()
+
+
+def _parse_line_range(line_range: str) -> tuple:
+    """Parse 'START:END' (1-based, inclusive) into (start, end); missing sides are None."""
+    start_text, separator, end_text = line_range.partition(':')
+    try:
+        start = int(start_text) if start_text.strip() else None
+        end = int(end_text) if end_text.strip() else None
+    except ValueError:
+        raise ValueError(f"Invalid line range '{line_range}' (expected START:END)") from None
+    if not separator and start is not None:
+        end = start  # A single number selects one line
+    if (start is not None and start < 1) or (end is not None and end < 1):
+        raise ValueError("Line numbers in --range start at 1.")
+    return start, end
+
+
+def _compressed_tail_chunks(file: str, lines: int, bytes_count: int, regex=None):
+    """Return the decompressed tail window of a compressed log as byte chunks."""
+    index = load_compressed_index(file)
+    if regex is not None and bytes_count is None:
+        # Compressed streams cannot be read backward; keep the last N matches
+        return collections.deque(iter_filtered_chunks(iter_compressed_range(file, index, 0), regex, split=True), maxlen=lines)
+    
+    if bytes_count is not None:
+        start_pos = max(0, index['size'] - bytes_count)
+    else:
+        start_pos = find_compressed_last_lines_offset(file, index, lines)
+    chunks = iter_compressed_range(file, index, start_pos)
+    return iter_filtered_chunks(chunks, regex) if regex is not None else chunks
+
+
+def _print_header(file: str, first: bool = False):
+    """Print a '==> FILE <==' header the way GNU tail does."""
+    if not first:
+        print()
+    print(f"==> {file} <==", flush=True)
+
+
+def _timestamped_lines(content: bytes, source_index: int, parse_timestamp):
+    """Yield (timestamp, source_index, line_number, line) for each line of a tail window.
+    Lines without a timestamp (e.g. stack traces) keep the timestamp of the line before them."""
+    timestamp = float('-inf')
+    for line_number, line in enumerate(content.splitlines(keepends=True)):
+        parsed = parse_timestamp(line)
+        if parsed is not None:
+            timestamp = parsed
+        yield timestamp, source_index, line_number, line
+
+
+def _print_merged(sources: list, parse_timestamp):
+    """K-way merge the tail windows of several files by line timestamp."""
+    streams = [_timestamped_lines(content, index, parse_timestamp) for index, content in enumerate(sources)]
+    for _, _, _, line in heapq.merge(*streams):
+        if not line.endswith(b'\n'):
+            line += b'\n'  # Keep a partial last line from running into the next one
+        print(line.decode('utf-8', errors='replace'), end='')
+
+
+class _FollowedFile:
+    """Open file and read position of a file followed by tail -f/-F."""
+    
+    def __init__(self, path: str, f, position: int, regex=None):
+        self.path = path
+        self.f = f
+        self.position = position
+        # With --grep, complete lines are filtered and a partial line waits for the rest
+        self.regex = regex
+        self.pending = b''
+        # Multibyte characters may be split across two reads
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    def read_new(self) -> str:
+        """Return whatever was appended since the last read."""
+        if self.f is None:
+            return ""
+        
+        file_size = os.fstat(self.f.fileno()).st_size
+        if file_size < self.position:
+            print(f"tail: {self.path}: file truncated", flush=True)
+            self.position = 0
+            self.pending = b''
+            self.decoder.reset()
+        
+        if file_size == self.position:
+            return ""
+        
+        self.f.seek(self.position)
+        content = self.f.read(file_size - self.position)
+        self.position += len(content)
+        if self.regex is not None:
+            content = self.pending + content
+            cut = content.rfind(b'\n') + 1
+            self.pending = content[cut:]
+            content = filter_lines(self.regex, content[:cut])
+        return self.decoder.decode(content)
+    
+    def reopen_if_replaced(self) -> str:
+        """Switch to the file currently at path if it is no longer the open one.
+        Returns the content drained from the old file, or None if nothing changed."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        
+        drained = ""
+        if self.f is not None:
+            current = os.fstat(self.f.fileno())
+            if (current.st_dev, current.st_ino) == (st.st_dev, st.st_ino):
+                return None
+            # Drain what was written to the old file before it was replaced
+            drained = self.read_new()
+            self.f.close()
+            self.f = None
+        
+        self.f = open(self.path, 'rb')
+        self.position = 0
+        self.pending = b''
+        self.decoder.reset()
+        return drained
+
+
+def _follow_files(followed: list, follow_name: bool, sleep_interval: float, show_headers: bool = False):
+    """Print data appended to the followed files until interrupted."""
+    last_printed = followed[-1].path
+    
+    def emit(item, content):
+        nonlocal last_printed
+        if not content:
+            return
+        if show_headers and item.path != last_printed:
+            _print_header(item.path)
+            last_printed = item.path
+        print(content, end='', flush=True)
+    
+    with FileWatcher(sleep_interval) as watcher:
+        for item in followed:
+            watcher.add(item.path)
+        
+        while True:
+            changed = watcher.wait(sleep_interval)
+            for item in followed:
+                # On timeout every file is checked, which also catches missed events
+                if changed and item.path not in changed:
+                    continue
+                if follow_name:
+                    had_file = item.f is not None
+                    drained = item.reopen_if_replaced()
+                    if drained is not None:
+                        emit(item, drained)
+                        state = "has been replaced" if had_file else "has appeared"
+                        print(f"tail: '{item.path}' {state}; following new file", flush=True)
+                        watcher.add(item.path)
+                emit(item, item.read_new())
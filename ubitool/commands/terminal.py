@@ -0,0 +1,106 @@
+"""Terminal output normalization for ubitool commands."""
+
+import re
+
+
+# CSI, OSC, DCS/SOS/PM/APC strings and the two-byte escapes (charset selection,
+# keypad mode, ...); erase in line is kept until the line has been rendered
+_ANSI_ESCAPE_RE = re.compile(rb'\x1b(?!\[[0-2]?K)(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[PX^_][^\x1b]*\x1b\\|[ -/]*[0-~])')
+
+# The start of an escape sequence whose end has not arrived yet
+_ANSI_PARTIAL_RE = re.compile(rb'\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[PX^_][^\x1b]*\x1b?|[ -/]*)')
+
+# Control characters other than tab and newline
+_CONTROL_CHARS_RE = re.compile(rb'[\x00-\x08\x0b-\x1f\x7f]')
+
+# What is left to remove once lines are rendered
+_LEFTOVER_CONTROLS_RE = re.compile(rb'\x1b\[[0-2]?K|[\x00-\x08\x0b-\x1f\x7f]')
+
+# Cursor movements applied within a line: carriage return, backspace and erase in line
+_LINE_CONTROL_RE = re.compile(rb'(\r|\x08|\x1b\[[0-2]?K)')
+
+# Lines that contain a carriage return or a backspace
+_REDRAWN_LINE_RE = re.compile(rb'[^\n\r\x08]*[\r\x08][^\n]*')
+
+# A line that long is rendered even before its newline arrives
+NORMALIZE_MAX_LINE = 64 * 1024
+
+
+def _render_line(line: bytes) -> bytes:
+    """Return a line (without escapes other than erase in line) as a terminal
+    would show it after its \\r, backspaces and erases."""
+    if b'\x08' not in line and b'\x1b' not in line and line.isascii():
+        # Only carriage returns: a redraw at least as long as every earlier one
+        # (the usual progress bar) simply replaces them
+        last = line.rstrip(b'\r').rpartition(b'\r')[2]
+        if len(last) == max(map(len, line.split(b'\r'))):
+            return last  # Control characters are removed afterwards
+    
+    cells = []
+    column = 0
+    # split() puts the control sequences at the odd indexes
+    for index, token in enumerate(_LINE_CONTROL_RE.split(line)):
+        if index % 2 == 0:
+            if token:
+                text = _CONTROL_CHARS_RE.sub(b'', token).decode('utf-8', 'surrogateescape')
+                if column > len(cells):
+                    cells.extend(' ' * (column - len(cells)))
+                cells[column:column + len(text)] = text
+                column += len(text)
+        elif token == b'\r':
+            column = 0
+        elif token == b'\x08':
+            column = max(0, column - 1)
+        else:
+            mode = token[2:-1] or b'0'
+            if mode == b'0':
+                del cells[column:]
+            elif mode == b'1':
+                blank = min(column + 1, len(cells))
+                cells[:blank] = ' ' * blank
+            else:
+                cells = []
+    return ''.join(cells).rstrip(' ').encode('utf-8', 'surrogateescape')
+
+
+def normalize_terminal_output(data: bytes) -> bytes:
+    """Turn terminal output (e.g. a tmux pane log) into plain text: escape
+    sequences and control characters are removed, and \\r, backspace and
+    erase in line are applied per line ('10%\\r20%\\n' becomes '20%\\n').
+    Data without control characters is returned as is; the regexes run over
+    the whole block and Python code only runs for redrawn lines."""
+    if not _CONTROL_CHARS_RE.search(data):
+        return data
+    data = _ANSI_ESCAPE_RE.sub(b'', data.replace(b'\r\n', b'\n'))
+    if b'\r' in data or b'\x08' in data:
+        data = _REDRAWN_LINE_RE.sub(lambda match: _render_line(match.group()), data)
+    return _LEFTOVER_CONTROLS_RE.sub(b'', data)
+
+
+class TerminalNormalizer:
+    """Incremental normalize_terminal_output for data read in chunks.
+    
+    Lines are normalized once their newline has arrived, so a \\r or an
+    escape sequence split between two chunks is still applied. flush()
+    normalizes the unfinished last line as far as it has been read (keeping
+    back a cut-off escape sequence unless final)."""
+    
+    def __init__(self):
+        self.pending = b''
+    
+    def feed(self, data: bytes) -> bytes:
+        data = self.pending + data
+        cut = data.rfind(b'\n') + 1
+        self.pending = data[cut:]
+        output = normalize_terminal_output(data[:cut])
+        if len(self.pending) > NORMALIZE_MAX_LINE:
+            output += self.flush()
+        return output
+    
+    def flush(self, final: bool = False) -> bytes:
+        data = self.pending
+        self.pending = b''
+        escape = data.rfind(b'\x1b')
+        if not final and escape >= 0 and _ANSI_PARTIAL_RE.fullmatch(data, escape):
+            data, self.pending = data[:escape], data[escape:]
+        return normalize_terminal_output(data)
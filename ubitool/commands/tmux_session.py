@@ -0,0 +1,433 @@
+"""Live output of tmux sessions (control mode and capture-pane) for ubitool commands."""
+
+import os
+import re
+import codecs
+import collections
+import time
+import signal
+import select
+import subprocess
+import operator
+import itertools
+from .utils import TAIL_BLOCK_SIZE, silence_stdout, StdoutWriter, _incomplete_utf8_length
+from .terminal import TerminalNormalizer
+from .htail import _raise_keyboard_interrupt, pane_label
+
+
+SESSION_BACKENDS = ("file", "control", "capture")
+
+# Seconds to wait for a control-mode client to attach
+TMUX_CONTROL_ATTACH_TIMEOUT = 5.0
+
+# Lines of scrollback taken by each capture-pane snapshot (capture-pane -S -N);
+# more output than this between two snapshots is partly missed
+TMUX_CAPTURE_HISTORY = 2000
+
+# Seconds between capture-pane snapshots while waiting for output
+TMUX_CAPTURE_INTERVAL = 0.25
+
+# Control mode escapes '\' and bytes below ' ' as \ooo
+_TMUX_OCTAL_ESCAPE_RE = re.compile(rb'\\([0-7]{3})')
+
+
+def _unescape_tmux_output(data: bytes) -> bytes:
+    """Undo the octal escaping of a control-mode %output payload."""
+    return _TMUX_OCTAL_ESCAPE_RE.sub(lambda match: bytes((int(match.group(1), 8) & 0xFF,)), data)
+
+
+class TmuxControlClient:
+    """Live output of the panes of a tmux session, read from a control-mode
+    client (tmux -C attach-session -r) instead of a pipe-pane log file.
+    
+    %output events are taken from the client's stdout as they arrive and
+    buffered per (window, pane) until take() is called; no log file or disk
+    polling is involved, so output is seen within milliseconds. Only output
+    produced after the client attached is seen. Panes are mapped from their
+    tmux id (%3) to window and pane index with list-panes, again whenever an
+    unknown id shows up. window/pane None selects all."""
+    
+    def __init__(self, target_session: str, window: int = 0, pane: int = 0, attach_timeout: float = TMUX_CONTROL_ATTACH_TIMEOUT):
+        self.target_session = target_session
+        self.window = window
+        self.pane = pane
+        self.buffers = {}
+        self.pane_ids = {}
+        self.closed = False
+        self._partial = b''
+        self.process = subprocess.Popen(["tmux", "-C", "attach-session", "-r", "-t", f"={target_session}"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.fd = self.process.stdout.fileno()
+        os.set_blocking(self.fd, False)
+        try:
+            self._wait_attached(attach_timeout)
+            self._update_pane_ids()
+        except Exception:
+            self.close()
+            raise
+    
+    def _wait_attached(self, timeout: float):
+        """Wait for the reply to attach-session, so no output sent after this returns is missed."""
+        deadline = time.monotonic() + timeout
+        reply = []
+        while True:
+            for line in self._read_lines():
+                if line.startswith((b'%end ', b'%error ')):
+                    if line.startswith(b'%error '):
+                        message = b' '.join(reply).decode('utf-8', 'replace') or "attach-session failed"
+                        raise RuntimeError(f"tmux control mode: {message}")
+                    return
+                if not line.startswith(b'%'):
+                    reply.append(line)
+                else:
+                    self._handle_line(line)
+            if self.closed:
+                raise RuntimeError(f"tmux control mode: client for session '{self.target_session}' exited")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"tmux control mode: no reply from session '{self.target_session}'")
+            select.select([self.fd], [], [], remaining)
+    
+    def _update_pane_ids(self):
+        """Map the tmux ids of the session's panes to (window, pane)."""
+        pane_ids = _list_tmux_panes(self.target_session)
+        if pane_ids is not None:
+            self.pane_ids.update(pane_ids)
+    
+    def _read_lines(self) -> list:
+        """Return the complete lines the client has written since the last call."""
+        chunks = [self._partial]
+        while True:
+            try:
+                chunk = os.read(self.fd, TAIL_BLOCK_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                self.closed = True
+                break
+            chunks.append(chunk)
+        data = b''.join(chunks)
+        cut = data.rfind(b'\n') + 1
+        self._partial = data[cut:]
+        return data[:cut].splitlines()
+    
+    def _handle_line(self, line: bytes):
+        if line.startswith(b'%output '):
+            _, pane_id, payload = (line.split(b' ', 2) + [b''])[:3]
+        elif line.startswith(b'%extended-output '):
+            # %extended-output %ID AGE ... : DATA
+            header, _, payload = line.partition(b' : ')
+            pane_id = header.split(b' ')[1]
+        else:
+            if line.startswith(b'%exit'):
+                self.closed = True
+            return
+        
+        if pane_id not in self.pane_ids:
+            self._update_pane_ids()  # A pane created after attaching
+        key = self.pane_ids.get(pane_id)
+        if key is None:
+            return
+        if (self.window is not None and key[0] != self.window) or (self.pane is not None and key[1] != self.pane):
+            return
+        self.buffers.setdefault(key, bytearray()).extend(_unescape_tmux_output(payload))
+    
+    def poll(self, timeout: float = 0) -> bool:
+        """Take the events that have arrived (waiting up to timeout for some).
+        Returns False once the client has exited (e.g. the session ended)."""
+        if timeout > 0:
+            if self.closed:
+                time.sleep(timeout)  # Nothing more will arrive; keep pollers from spinning
+            else:
+                select.select([self.fd], [], [], timeout)
+        for line in self._read_lines():
+            self._handle_line(line)
+        return not self.closed
+    
+    def panes(self) -> list:
+        """Return the selected (window, pane) of the session, ordered."""
+        return sorted(key for key in self.pane_ids.values()
+                      if (self.window is None or key[0] == self.window) and (self.pane is None or key[1] == self.pane))
+    
+    def take(self, window: int, pane: int) -> bytes:
+        """Return and forget the output of a pane received so far."""
+        self.poll()
+        buffer = self.buffers.pop((window, pane), None)
+        return bytes(buffer) if buffer else b''
+    
+    def fileno(self) -> int:
+        return self.fd
+    
+    def close(self):
+        if self.process.poll() is None:
+            # Closing stdin detaches the client
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process.stdout.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _list_tmux_panes(target_session: str) -> dict:
+    """Return {pane id (b'%3'): (window, pane)} for the panes of a session, or None if tmux fails."""
+    result = subprocess.run(["tmux", "list-panes", "-s", "-t", f"={target_session}", "-F", "#{pane_id} #{window_index} #{pane_index}"],
+                            capture_output=True, text=True, timeout=5)
+    if result.returncode != 0:
+        return None
+    pane_ids = {}
+    for line in result.stdout.splitlines():
+        pane_id, window, pane = line.split()
+        pane_ids[pane_id.encode()] = (int(window), int(pane))
+    return pane_ids
+
+
+class TmuxCaptureClient:
+    """Output of the panes of a tmux session, recovered from successive
+    capture-pane snapshots; works on any session, without pipe-pane logging.
+    
+    Each poll takes the last TMUX_CAPTURE_HISTORY lines of scrollback plus
+    the screen (capture-pane -p -J -S -N) of every selected pane and lines it
+    up with the previous snapshot of that pane. Lines scroll off the top of
+    the history as output is added, so the offset of the new snapshot in the
+    old one is found through a line-hash anchor: the old snapshot is indexed
+    by line ({line: [index, ...]}) and the first line of the new one is looked
+    up in it, the candidates being verified in order. Only the lines after the
+    overlap (and the rest of the cursor line) are buffered for take().
+    
+    Like TmuxControlClient, only output produced after the first snapshot is
+    seen; the output is plain text as shown on screen (no escape sequences).
+    A changed line that was already shown, e.g. a redraw of a full-screen
+    program, is shown again. window/pane None selects all."""
+    
+    def __init__(self, target_session: str, window: int = 0, pane: int = 0, history: int = TMUX_CAPTURE_HISTORY, interval: float = TMUX_CAPTURE_INTERVAL):
+        self.target_session = target_session
+        self.window = window
+        self.pane = pane
+        self.history = history
+        self.interval = interval
+        self.buffers = {}
+        self.pane_ids = {}
+        self.closed = False
+        self.snapshots = {}  # (window, pane) -> (lines, {line: [index, ...]})
+        pane_ids = _list_tmux_panes(target_session)
+        if pane_ids is None:
+            raise RuntimeError(f"tmux capture-pane: can't find session '{target_session}'")
+        self.pane_ids = pane_ids
+        # The first snapshot is the baseline; output already on screen is not shown
+        self._capture_all()
+    
+    def _capture(self, window: int, pane: int) -> list:
+        """Return the lines of a pane's scrollback and screen, without the blank rows below the cursor; None if it is gone."""
+        result = subprocess.run(["tmux", "capture-pane", "-p", "-J", "-S", f"-{self.history}", "-t", f"={self.target_session}:{window}.{pane}"],
+                                capture_output=True, timeout=5)
+        if result.returncode != 0:
+            return None
+        lines = result.stdout.split(b'\n')
+        while lines and not lines[-1].strip():
+            lines.pop()
+        return lines
+    
+    def _capture_all(self) -> bool:
+        """Take a snapshot of every selected pane; returns True if there was new output."""
+        pane_ids = _list_tmux_panes(self.target_session)
+        if pane_ids is None:
+            self.closed = True  # The session ended
+            return False
+        self.pane_ids = pane_ids
+        found = False
+        for key in self.panes():
+            lines = self._capture(*key)
+            if lines is None:
+                continue
+            previous = self.snapshots.get(key)
+            positions = {}
+            for index, line in enumerate(lines):
+                positions.setdefault(line, []).append(index)
+            self.snapshots[key] = (lines, positions)
+            if previous is None:
+                continue
+            data = _snapshot_difference(previous, lines)
+            if data:
+                self.buffers.setdefault(key, bytearray()).extend(data)
+                found = True
+        return found
+    
+    def poll(self, timeout: float = 0) -> bool:
+        """Take snapshots until one has new output or timeout seconds elapse.
+        Returns False once the session has ended."""
+        deadline = time.monotonic() + timeout
+        while not self._capture_all() and not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.interval, remaining))
+        if self.closed and timeout > 0:
+            time.sleep(max(0.0, deadline - time.monotonic()))  # Keep pollers from spinning
+        return not self.closed
+    
+    def panes(self) -> list:
+        """Return the selected (window, pane) of the session, ordered."""
+        return sorted(key for key in self.pane_ids.values()
+                      if (self.window is None or key[0] == self.window) and (self.pane is None or key[1] == self.pane))
+    
+    def take(self, window: int, pane: int) -> bytes:
+        """Return and forget the output of a pane found so far."""
+        buffer = self.buffers.pop((window, pane), None)
+        return bytes(buffer) if buffer else b''
+    
+    def close(self):
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _snapshot_offset(previous: tuple, lines: list) -> int:
+    """Return the index in the previous snapshot ((lines, positions)) where
+    lines starts, i.e. the number of lines that scrolled out; None if the two
+    do not overlap (e.g. the history was cleared)."""
+    previous_lines, positions = previous
+    # The cursor line may have grown since, so it does not have to match
+    stable = len(previous_lines) - 1
+    for offset in positions.get(lines[0], ()):
+        overlap = min(stable - offset, len(lines))
+        if overlap <= 0:
+            return offset
+        if all(map(operator.eq, itertools.islice(previous_lines, offset, offset + overlap), lines)):
+            return offset
+    if lines[0].startswith(previous_lines[-1]):
+        return stable  # Only the cursor line is left, with more written on it
+    return None
+
+
+def _snapshot_difference(previous: tuple, lines: list) -> bytes:
+    """Return the output between two snapshots of a pane, as it would have
+    been written to the terminal: the rest of the cursor line, then the new
+    lines, the last one (the new cursor line) without its newline."""
+    previous_lines = previous[0]
+    if not lines:
+        return b''
+    if not previous_lines:
+        return b'\n'.join(lines)
+    offset = _snapshot_offset(previous, lines)
+    if offset is None:
+        # Nothing in common; everything is new
+        return b'\n' + b'\n'.join(lines)
+    
+    old = previous_lines[offset:]
+    common = 0
+    for old_line, line in zip(old, lines):
+        if old_line != line:
+            break
+        common += 1
+    
+    if common >= len(old):
+        # The old snapshot continues unchanged
+        added = lines[common:]
+        return b'\n' + b'\n'.join(added) if added else b''
+    if common == len(old) - 1 and lines[common].startswith(old[-1]):
+        # More was written on the cursor line
+        data = lines[common][len(old[-1]):]
+    else:
+        # Lines already shown were changed (cursor line edited, screen redrawn)
+        data = b'\n' + lines[common]
+    if common + 1 < len(lines):
+        data += b'\n' + b'\n'.join(lines[common + 1:])
+    return data
+
+
+class TmuxPaneReader:
+    """The output of one pane of a TmuxControlClient or TmuxCaptureClient,
+    with the read API of HtailReader (read, read_text, skip_to_end, commit).
+    Live output has no saved position, so commit() has nothing to save."""
+    
+    def __init__(self, client: TmuxControlClient, window: int, pane: int):
+        self.client = client
+        self.window = window
+        self.pane = pane
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    def read(self) -> bytes:
+        """Return the output of the pane since the last read."""
+        return self.client.take(self.window, self.pane)
+    
+    def read_text(self) -> str:
+        return self.decoder.decode(self.read())
+    
+    def skip_to_end(self):
+        """Drop the output received so far."""
+        self.client.poll()
+        self.client.take(self.window, self.pane)
+        self.decoder.reset()
+    
+    def commit(self, position: int = None) -> bool:
+        return True
+    
+    def close(self):
+        pass
+
+
+# Live-output clients by shtail/stssend --backend ("file" reads the pipe-pane logs)
+SESSION_CLIENTS = {"control": TmuxControlClient, "capture": TmuxCaptureClient}
+
+
+def follow_control_output(client: TmuxControlClient, labeled: bool = False, normalize: bool = False):
+    """Print the live output of the client's panes (TmuxControlClient or
+    TmuxCaptureClient) until interrupted or the session ends (shtail --backend
+    control/capture). When labeled, output is preceded by a
+    '==> SESSION:WINDOW.PANE <==' header whenever it comes from another pane
+    than before. With normalize, each pane has a TerminalNormalizer, which
+    holds an unfinished line until its newline arrives (or following ends)."""
+    writer = StdoutWriter()
+    pending = {}
+    normalizers = collections.defaultdict(TerminalNormalizer)
+    last_label = None
+    previous_handler = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    
+    def write(key, data: bytes):
+        nonlocal last_label
+        if not data:
+            return
+        label = pane_label(client.target_session, *key) if labeled else None
+        if label is not None and label != last_label:
+            writer.write(f"\n==> {label} <==\n".encode('utf-8', 'surrogateescape'))
+            last_label = label
+        writer.write(data)
+    
+    try:
+        while True:
+            alive = client.poll(1.0)
+            for key in sorted(client.buffers):
+                data = pending.pop(key, b'') + client.take(*key)
+                # A character split between two events waits for the rest
+                cut = len(data) - _incomplete_utf8_length(data)
+                if cut < len(data):
+                    pending[key] = data[cut:]
+                data = data[:cut]
+                if normalize:
+                    data = normalizers[key].feed(data)
+                write(key, data)
+            writer.flush()
+            if not alive:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        try:
+            for key in sorted(normalizers):
+                write(key, normalizers[key].flush(final=True))
+            writer.flush(final=True)
+        except BrokenPipeError:
+            silence_stdout()
@@ -1,190 +1,622 @@
 """Common utility functions for ubitool commands."""
 
 import os
+import io
+import re
+import sys
+import array
+import bisect
+import codecs
+import hashlib
+import time
+import datetime
+import struct
+import types
+import importlib
 
 
-def get_new_content_as_string(file: str, position_file: str, last_position: int, lines: int, bytes_count: int, update_position: bool = True) -> tuple[str, bool]:
-    """Helper function to read new content from file since last position and return as string.
-    Returns tuple of (content_string, found_new_content).
-    If update_position is False, the position file will not be updated (keep mode)."""
-    try:
-        if bytes_count is not None:
-            # Handle bytes mode
-            with open(file, 'rb') as f:
-                f.seek(last_position)
-                new_content = f.read()
-                current_position = f.tell()
-            
-            if new_content:
-                # Get the last N bytes of new content
-                if len(new_content) > bytes_count:
-                    output_content = new_content[-bytes_count:]
-                else:
-                    output_content = new_content
-                
-                # Convert to text, handling encoding
-                try:
-                    content_str = output_content.decode('utf-8')
-                except UnicodeDecodeError:
-                    content_str = output_content.decode('utf-8', errors='replace')
-                
-                # Save the new position (only if update_position is True)
-                if update_position:
-                    with open(position_file, 'w') as f:
-                        f.write(str(current_position))
-                return content_str, True
-        else:
-            # Handle lines mode - read as binary first to avoid encoding errors
-            with open(file, 'rb') as f:
-                f.seek(last_position)
-                new_content_bytes = f.read()
-                current_position = f.tell()
-            
-            if new_content_bytes:
-                # Decode with error handling
-                try:
-                    new_content = new_content_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                    # If UTF-8 fails, try with replacement characters
-                    new_content = new_content_bytes.decode('utf-8', errors='replace')
-                
-                # Split into lines and get the last N lines of new content
-                new_lines = new_content.splitlines(keepends=True)
-                
-                # If we have more lines than requested, show only the last N lines
-                if lines and len(new_lines) > lines:
-                    output_lines = new_lines[-lines:]
-                else:
-                    output_lines = new_lines
-                
-                # Join lines into string
-                content_str = ''.join(output_lines)
-                
-                # Save the new position (only if update_position is True)
-                if update_position:
-                    with open(position_file, 'w') as f:
-                        f.write(str(current_position))
-                return content_str, True
+# Block size used when scanning files backward from the end
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def find_last_lines_offset(f, lines: int, start: int = 0, end: int = None, block_size: int = TAIL_BLOCK_SIZE) -> int:
+    """Find the byte offset where the last N lines of a binary file object begin.
+    The file is scanned backward from end in fixed-size blocks and scanning
+    stops as soon as N line breaks are found, so the cost depends on the size
+    of the output rather than the size of the file.
+    Scanning never goes below start; start is returned if fewer lines exist."""
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    
+    if end <= start:
+        return end
+    
+    # A trailing newline terminates the last line rather than starting a new one
+    f.seek(end - 1)
+    scan_end = end - 1 if f.read(1) == b'\n' else end
+    
+    remaining = lines
+    pos = scan_end
+    while pos > start:
+        block_start = max(start, pos - block_size)
+        f.seek(block_start)
+        block = f.read(pos - block_start)
         
-        return "", False
+        # Skip whole blocks quickly when they cannot contain the boundary
+        newline_count = block.count(b'\n')
+        if newline_count < remaining:
+            remaining -= newline_count
+            pos = block_start
+            continue
         
-    except Exception as e:
-        print(f"Error reading file '{file}': {e}")
-        return "", False
+        index = len(block)
+        while True:
+            index = block.rfind(b'\n', 0, index)
+            remaining -= 1
+            if remaining == 0:
+                return block_start + index + 1
+    
+    return start
+
+
+def compile_grep_pattern(pattern: str):
+    """Compile a --grep pattern as a bytes regex so it runs on raw, undecoded data.
+    ^ and $ match at line boundaries."""
+    try:
+        return re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    except re.error as e:
+        raise ValueError(f"Invalid --grep pattern '{pattern}': {e}") from None
 
 
-def read_new_content(file: str, position_file: str, last_position: int, lines: int, bytes_count: int, update_position: bool = True) -> bool:
-    """Helper function to read new content from file since last position.
-    Returns True if new content was found and displayed, False otherwise.
-    If update_position is False, the position file will not be updated (keep mode)."""
-    # Use the shared function to get content as string
-    content_str, found_content = get_new_content_as_string(file, position_file, last_position, lines, bytes_count, update_position)
+def _matching_lines(regex, data: bytes) -> list:
+    """Return the lines of data (bytes made of whole lines) that regex matches.
+    The regex scans the whole block at C speed; Python only runs per match."""
+    matched = []
+    position = 0
+    length = len(data)
+    while position < length:
+        match = regex.search(data, position)
+        if match is None:
+            break
+        line_start = data.rfind(b'\n', 0, match.start()) + 1
+        if line_start < position:
+            # The match began on an already handled line; retry at the next one
+            line_start = position
+        line_end = data.find(b'\n', max(match.start(), match.end() - 1, line_start))
+        line_end = length if line_end < 0 else line_end + 1
+        if match.start() < line_end:
+            matched.append(data[line_start:line_end])
+        position = line_end
+    return matched
+
+
+def filter_lines(regex, data: bytes) -> bytes:
+    """Keep only the lines of data that regex matches."""
+    return b''.join(_matching_lines(regex, data))
+
+
+def iter_filtered_chunks(chunks, regex, split: bool = False):
+    """Filter a stream of byte chunks line by line, carrying partial lines
+    across chunk boundaries. Yields the matching lines of each chunk joined
+    together, or one by one if split is True."""
+    pending = b''
+    for chunk in chunks:
+        data = pending + chunk
+        cut = data.rfind(b'\n') + 1
+        pending = data[cut:]
+        if cut:
+            matched = _matching_lines(regex, data[:cut])
+            if split:
+                yield from matched
+            elif matched:
+                yield b''.join(matched)
+    if pending:
+        matched = _matching_lines(regex, pending)
+        if split:
+            yield from matched
+        elif matched:
+            yield b''.join(matched)
+
+
+def find_last_matching_lines(f, regex, lines: int, start: int = 0, end: int = None, block_size: int = TAIL_BLOCK_SIZE, bytes_count: int = None) -> list:
+    """Return the last N lines in [start, end) of a binary file that regex matches.
+    Blocks are read backward from end, aligned to line boundaries, and reading
+    stops as soon as N matching lines (or bytes_count bytes of them) are found."""
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
     
-    if found_content:
-        print(content_str, end='')
-        return True
+    found = []
+    found_bytes = 0
+    position = end
+    size = block_size
+    while position > start:
+        if lines is not None and len(found) >= lines:
+            break
+        if bytes_count is not None and found_bytes >= bytes_count:
+            break
+        block_start = max(start, position - size)
+        f.seek(block_start)
+        block = f.read(position - block_start)
+        if block_start > start:
+            # Only keep whole lines; the partial first line is read with the next block
+            first_newline = block.find(b'\n')
+            if first_newline < 0 or first_newline == len(block) - 1:
+                size *= 2  # No whole line fits in the block yet
+                continue
+            block = block[first_newline + 1:]
+            block_start += first_newline + 1
+        matched = _matching_lines(regex, block)
+        found[:0] = matched
+        found_bytes += sum(len(line) for line in matched)
+        position = block_start
+        size = block_size
+    return found[-lines:] if lines is not None else found
+
+
+def _stdout_fileno():
+    """Return the file descriptor behind sys.stdout, or None if there is none."""
+    try:
+        return sys.stdout.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def silence_stdout():
+    """Point stdout at /dev/null after the reader went away (e.g. piped to head),
+    so the final flush at exit does not raise BrokenPipeError again."""
+    out_fd = _stdout_fileno()
+    if out_fd is not None:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out_fd)
+        os.close(devnull)
+
+
+def iter_file_range(f, start: int, end: int, block_size: int = TAIL_BLOCK_SIZE):
+    """Yield bytes [start, end) of a binary file object in blocks."""
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(block_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class StdoutWriter:
+    """Write byte chunks to stdout.
+    Bytes are passed through untouched unless stdout is a terminal (or has no
+    file descriptor), in which case they are decoded incrementally as UTF-8."""
+    
+    def __init__(self):
+        out_fd = _stdout_fileno()
+        if out_fd is None or os.isatty(out_fd):
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        else:
+            self.decoder = None
+            sys.stdout.flush()  # Keep earlier text output in order
+    
+    def write(self, chunk: bytes):
+        if self.decoder is not None:
+            print(self.decoder.decode(chunk), end='')
+        else:
+            sys.stdout.buffer.write(chunk)
     
-    return False
+    def flush(self, final: bool = False):
+        if self.decoder is not None:
+            if final:
+                print(self.decoder.decode(b'', final=True), end='')
+            sys.stdout.flush()
+        else:
+            sys.stdout.buffer.flush()
+
 
+def write_chunks(chunks):
+    """Write an iterable of byte chunks to stdout (see StdoutWriter)."""
+    writer = StdoutWriter()
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.flush(final=True)
 
-def execute_htail_logic(file: str, lines: int, bytes_count: int, reset: bool, last: bool, keep: bool):
-    """Execute htail logic on a specific file - shared between htail and shtail commands"""
-    import time
+
+def write_file_range(f, start: int, end: int, block_size: int = TAIL_BLOCK_SIZE):
+    """Write bytes [start, end) of a binary file object to stdout.
     
-    # Check if file exists
-    if not os.path.exists(file):
-        print(f"Warning: File '{file}' does not exist.")
+    When stdout is a file or pipe the bytes are passed through untouched with
+    os.sendfile (or buffered writes if sendfile is not possible), so nothing
+    is decoded. Only a terminal, or a stdout that has no file descriptor,
+    gets the UTF-8 decoded text, in blocks so memory use stays bounded."""
+    if end <= start:
         return
     
-    # Set default values if neither option is specified
-    if lines is None and bytes_count is None:
-        lines = 10  # Default to 10 lines
+    out_fd = _stdout_fileno()
+    if out_fd is not None and not os.isatty(out_fd) and hasattr(os, 'sendfile'):
+        sys.stdout.flush()
+        try:
+            while start < end:
+                sent = os.sendfile(out_fd, f.fileno(), start, end - start)
+                if sent == 0:
+                    break
+                start += sent
+            return
+        except OSError as e:
+            # e.g. EINVAL for an O_APPEND stdout; continue with plain writes
+            if isinstance(e, BrokenPipeError):
+                raise
     
-    if lines is not None and lines <= 0:
-        print("Warning: Number of lines must be greater than 0.")
-        return
+    write_chunks(iter_file_range(f, start, end, block_size))
+
+
+def _find_nth_newline(data: bytes, n: int, start: int = 0) -> int:
+    """Return the index of the n-th (1-based) newline in data at or after start, or -1.
+    Narrows the range with bytes.count() so no Python loop runs per line."""
+    low, high = start, len(data)
+    while high - low > 256:
+        middle = (low + high) // 2
+        count = data.count(b'\n', low, middle)
+        if count >= n:
+            high = middle
+        else:
+            n -= count
+            low = middle
+    index = low - 1
+    for _ in range(n):
+        index = data.find(b'\n', index + 1, high)
+        if index < 0:
+            return -1
+    return index
+
+
+class LineIndex:
+    """Sampled line-offset index of a text file, persisted as .FILE.lidx.
     
-    if bytes_count is not None and bytes_count <= 0:
-        print("Warning: Number of bytes must be greater than 0.")
-        return
+    offsets[i] is the byte offset where line i * step starts (0-based), stored
+    as a compact array('Q'). The index is extended incrementally from the last
+    indexed offset when the file grows and rebuilt if the file was replaced,
+    truncated, or its first HEAD_SIZE bytes changed (copytruncate followed by
+    new writes). Locating a line costs one seek plus a scan of at most step lines."""
     
-    try:
-        # Get the position file path (same directory as the target file)
+    MAGIC = b'UBLIDX2\0'
+    # magic, step, st_ino, indexed_end, newline_count, head_length, head_digest
+    HEADER = struct.Struct('<8sQQQQQ20s')
+    DEFAULT_STEP = 1000
+    HEAD_SIZE = 4096
+    EMPTY_HEAD_DIGEST = hashlib.sha1(b'').digest()
+    
+    def __init__(self, file: str, step: int = DEFAULT_STEP):
+        self.file = file
+        self.step = step
+        self.ino = 0
+        self.indexed_end = 0
+        self.newline_count = 0
+        self.ends_with_newline = True
+        self.head_length = 0
+        self.head_digest = self.EMPTY_HEAD_DIGEST
+        self.offsets = array.array('Q', [0])
+    
+    @staticmethod
+    def get_index_file(file: str) -> str:
+        """Return the path of the sidecar index file (.FILE.lidx)."""
         file_dir = os.path.dirname(os.path.abspath(file))
         file_name = os.path.basename(file)
-        position_file = os.path.join(file_dir, f".{file_name}.htail")
-        
-        # Handle reset option
-        if reset:
-            if os.path.exists(position_file):
-                os.remove(position_file)
-            last_position = 0
+        return os.path.join(file_dir, f".{file_name}.lidx")
+    
+    @classmethod
+    def open(cls, file: str, f=None, step: int = DEFAULT_STEP):
+        """Load the index of a file and bring it up to date with the file's end."""
+        index = cls(file, step)
+        index._load()
+        if f is not None:
+            index.update(f)
         else:
-            # Read the last saved position
-            last_position = 0
-            if os.path.exists(position_file):
-                try:
-                    with open(position_file, 'r') as f:
-                        last_position = int(f.read().strip())
-                except (ValueError, IOError):
-                    last_position = 0
-        
-        # Handle last option (mark current end as read)
-        if last:
             with open(file, 'rb') as f:
-                f.seek(0, 2)  # Go to end of file
-                current_position = f.tell()
-            with open(position_file, 'w') as f:
-                f.write(str(current_position))
+                index.update(f)
+        return index
+    
+    def _load(self):
+        try:
+            with open(self.get_index_file(self.file), 'rb') as f:
+                header = f.read(self.HEADER.size)
+                offsets = array.array('Q')
+                offsets.frombytes(f.read())
+        except OSError:
+            return
+        if len(header) != self.HEADER.size:
+            return
+        magic, step, ino, indexed_end, newline_count, head_length, head_digest = self.HEADER.unpack(header)
+        if magic != self.MAGIC or step != self.step or not offsets:
+            return
+        self.ino = ino
+        self.indexed_end = indexed_end
+        self.newline_count = newline_count
+        self.head_length = head_length
+        self.head_digest = head_digest
+        self.offsets = offsets
+    
+    def save(self):
+        """Write the index next to the file; failures are ignored as it is only a cache."""
+        try:
+            with open(self.get_index_file(self.file), 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.step, self.ino, self.indexed_end, self.newline_count,
+                                         self.head_length, self.head_digest))
+                f.write(self.offsets.tobytes())
+        except OSError:
+            pass
+    
+    def update(self, f, block_size: int = TAIL_BLOCK_SIZE):
+        """Index the data appended since the last update."""
+        st = os.fstat(f.fileno())
+        if (st.st_ino != self.ino or st.st_size < self.indexed_end
+                or self._read_head_digest(f, self.head_length) != self.head_digest):
+            # Replaced, truncated, or truncated and written again: start over
+            self.ino = st.st_ino
+            self.indexed_end = 0
+            self.newline_count = 0
+            self.head_length = 0
+            self.head_digest = self.EMPTY_HEAD_DIGEST
+            self.offsets = array.array('Q', [0])
+        
+        if st.st_size == self.indexed_end:
+            self._check_last_byte(f)
             return
         
-        # Read new content (keep mode affects whether position is updated)
-        read_new_content(file, position_file, last_position, lines, bytes_count, not keep)
-            
-    except Exception as e:
-        print(f"Error reading file '{file}': {e}")
+        f.seek(self.indexed_end)
+        position = self.indexed_end
+        while position < st.st_size:
+            block = f.read(min(block_size, st.st_size - position))
+            if not block:
+                break
+            block_newlines = block.count(b'\n')
+            index = 0
+            # Record the start of every step-th line that begins in this block
+            while True:
+                next_checkpoint = len(self.offsets) * self.step
+                needed = next_checkpoint - self.newline_count
+                if needed > block_newlines:
+                    break
+                newline = _find_nth_newline(block, needed, index)
+                self.offsets.append(position + newline + 1)
+                block_newlines -= needed
+                self.newline_count += needed
+                index = newline + 1
+            self.newline_count += block_newlines
+            position += len(block)
+        
+        self.indexed_end = position
+        if self.head_length < min(self.HEAD_SIZE, self.indexed_end):
+            self.head_length = min(self.HEAD_SIZE, self.indexed_end)
+            self.head_digest = self._read_head_digest(f, self.head_length)
+        self._check_last_byte(f)
+        self.save()
+    
+    @staticmethod
+    def _read_head_digest(f, length: int) -> bytes:
+        f.seek(0)
+        return hashlib.sha1(f.read(length)).digest()
+    
+    def _check_last_byte(self, f):
+        if self.indexed_end > 0:
+            f.seek(self.indexed_end - 1)
+            self.ends_with_newline = f.read(1) == b'\n'
+    
+    @property
+    def line_count(self) -> int:
+        """Number of lines in the indexed part, counting a final unterminated line."""
+        return self.newline_count + (0 if self.ends_with_newline else 1)
+    
+    def line_offset(self, f, line_number: int, block_size: int = TAIL_BLOCK_SIZE) -> int:
+        """Return the byte offset where a 0-based line starts (indexed_end if past the end)."""
+        if line_number > self.newline_count:
+            return self.indexed_end
+        checkpoint = min(line_number // self.step, len(self.offsets) - 1)
+        position = self.offsets[checkpoint]
+        remaining = line_number - checkpoint * self.step
+        f.seek(position)
+        while remaining > 0 and position < self.indexed_end:
+            block = f.read(min(block_size, self.indexed_end - position))
+            if not block:
+                break
+            block_newlines = block.count(b'\n')
+            if block_newlines >= remaining:
+                return position + _find_nth_newline(block, remaining) + 1
+            remaining -= block_newlines
+            position += len(block)
+        return min(position, self.indexed_end)
+    
+    def count_newlines_before(self, f, offset: int, block_size: int = TAIL_BLOCK_SIZE) -> int:
+        """Return the number of newlines in [0, offset) using the nearest checkpoint."""
+        offset = min(offset, self.indexed_end)
+        checkpoint = bisect.bisect_right(self.offsets, offset) - 1
+        position = self.offsets[checkpoint]
+        count = checkpoint * self.step
+        f.seek(position)
+        while position < offset:
+            block = f.read(min(block_size, offset - position))
+            if not block:
+                break
+            count += block.count(b'\n')
+            position += len(block)
+        return count
 
 
-def get_htail_content_for_session(target_session: str, lines: int = None, bytes_count: int = None, keep: bool = True, output_path: str = None) -> str:
-    """Get new content from tmux session log using htail logic.
-    Returns the new content as a string.
-    This function is used by stssend to read session output."""
-    import glob as glob_module
+# Default log timestamp, e.g. "2025-01-01 10:00:01" or "[2025-01-01 09:00:00]"
+DEFAULT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Regex fragments for the strptime directives that appear in log timestamps
+_TIME_DIRECTIVE_PATTERNS = {
+    'Y': r'\d{4}', 'y': r'\d{2}', 'm': r'\d{1,2}', 'd': r'\d{1,2}', 'e': r' ?\d{1,2}',
+    'H': r'\d{1,2}', 'I': r'\d{1,2}', 'M': r'\d{1,2}', 'S': r'\d{1,2}', 'f': r'\d{1,6}',
+    'j': r'\d{1,3}', 'b': r'[A-Za-z]{3}', 'a': r'[A-Za-z]{3}', 'B': r'[A-Za-z]+', 'A': r'[A-Za-z]+',
+    'p': r'[AaPp][Mm]', 'z': r'[+-]\d{2}:?\d{2}|Z', 'Z': r'[A-Za-z]+', '%': '%',
+}
+
+_timestamp_parsers = {}
+
+
+def compile_timestamp_parser(time_format: str = None):
+    """Return a function that parses the timestamp at the start of a log line.
+    
+    The returned function takes a line as bytes and returns the time as a
+    POSIX timestamp (float), or None if the line does not start with a
+    timestamp in the given strptime format. With the default format an
+    optional leading '[' and fractional seconds are accepted as well.
+    Timestamps without a year are placed in the current year."""
+    if time_format in _timestamp_parsers:
+        return _timestamp_parsers[time_format]
+    
+    fmt = time_format or DEFAULT_TIME_FORMAT
+    pattern = ''
+    # strptime has no %e (space-padded day); its %d accepts a leading space
+    strptime_fmt = ''
+    index = 0
+    while index < len(fmt):
+        char = fmt[index]
+        if char == '%' and index + 1 < len(fmt):
+            directive = fmt[index + 1]
+            if directive not in _TIME_DIRECTIVE_PATTERNS:
+                raise ValueError(f"Unsupported time format directive '%{directive}'")
+            pattern += f"(?:{_TIME_DIRECTIVE_PATTERNS[directive]})"
+            strptime_fmt += '%d' if directive == 'e' else fmt[index:index + 2]
+            index += 2
+        elif char.isspace():
+            # Like strptime, any run of whitespace matches (e.g. "Jan  5")
+            while index < len(fmt) and fmt[index].isspace():
+                index += 1
+            pattern += r'\s+'
+            strptime_fmt += ' '
+        else:
+            pattern += re.escape(char)
+            strptime_fmt += char
+            index += 1
+    
+    if time_format is None:
+        regex = re.compile((r'\[?(' + pattern + r')(?:[.,](\d{1,6}))?').encode('ascii'))
+    else:
+        regex = re.compile(('(' + pattern + ')').encode('ascii'))
+    has_year = '%Y' in fmt or '%y' in fmt
     
-    # Use provided output_path or default log path for tmux sessions
-    log_path = os.path.expanduser(output_path) if output_path else os.path.expanduser("~/Workspace/log/tmux")
+    def parse(line: bytes):
+        match = regex.match(line)
+        if match is None:
+            return None
+        try:
+            parsed = datetime.datetime.strptime(match.group(1).decode('ascii'), strptime_fmt)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not has_year:
+            parsed = parsed.replace(year=datetime.datetime.now().year)
+        timestamp = parsed.timestamp()
+        if time_format is None and match.group(2):
+            fraction = match.group(2)
+            timestamp += int(fraction) / (10 ** len(fraction))
+        return timestamp
     
+    _timestamp_parsers[time_format] = parse
+    return parse
+
+
+# Relative times for --since/--until, e.g. "5m", "2h", "90s ago"
+_RELATIVE_TIME_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhd])(?:\s+ago)?\s*$')
+_RELATIVE_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time_argument(value: str, time_format: str = None) -> float:
+    """Convert a --since/--until argument to a POSIX timestamp.
+    Accepts a relative age ("30s", "5m", "2h", "1d", optionally followed by
+    "ago"), a timestamp in the log's time format, or an ISO 8601 timestamp."""
+    match = _RELATIVE_TIME_RE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _RELATIVE_TIME_UNITS[match.group(2)]
+    
+    timestamp = compile_timestamp_parser(time_format)(value.strip().encode('utf-8'))
+    if timestamp is not None:
+        return timestamp
     try:
-        # Build the pattern for tmux log files
-        pattern = os.path.join(log_path, f"session_{target_session}_window_0_pane_0_*.log")
-        
-        # Find matching log files
-        log_files = glob_module.glob(pattern)
-        
-        if not log_files:
-            return ""  # No log files found
-        
-        # Sort by modification time and get the latest file
-        latest_file = max(log_files, key=os.path.getmtime)
-        
-        # Get the position file path
-        file_dir = os.path.dirname(os.path.abspath(latest_file))
-        file_name = os.path.basename(latest_file)
-        position_file = os.path.join(file_dir, f".{file_name}.htail")
-        
-        # Read the last saved position
-        last_position = 0
-        if os.path.exists(position_file):
-            try:
-                with open(position_file, 'r') as f:
-                    last_position = int(f.read().strip())
-            except (ValueError, IOError):
-                last_position = 0
-        
-        # Get new content as string
-        content_str, _ = get_new_content_as_string(latest_file, position_file, last_position, lines, bytes_count, not keep)
-        return content_str
-        
-    except Exception as e:
-        print(f"Error getting content for session '{target_session}': {e}")
-        return ""
\ No newline at end of file
+        return datetime.datetime.fromisoformat(value.strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}' (expected e.g. '5m', '2h' or a timestamp)") from None
+
+
+def _first_timestamp_at_or_after(f, offset: int, start: int, end: int, parse_timestamp):
+    """Return (line_start, timestamp) of the first timestamped line that starts
+    at or after offset, re-syncing to the next line boundary first.
+    Returns None if there is no such line before end."""
+    if offset > start:
+        # offset may be in the middle of a line; skip to the start of the next one
+        f.seek(offset - 1)
+        f.readline()
+        line_start = f.tell()
+    else:
+        f.seek(start)
+        line_start = start
+    
+    while line_start < end:
+        line = f.readline()
+        if not line:
+            break
+        timestamp = parse_timestamp(line)
+        if timestamp is not None:
+            return line_start, timestamp
+        line_start += len(line)
+    return None
+
+
+def find_time_offset(f, target: float, parse_timestamp, start: int = 0, end: int = None, inclusive: bool = True) -> int:
+    """Binary search a timestamp-ordered log for the first line at or after target.
+    
+    Returns the offset of the first line whose timestamp is >= target
+    (> target if inclusive is False), or end if there is none. Each probe
+    seeks to an offset, re-syncs to the next newline and parses the first
+    timestamped line, so only O(log n) small reads are done. Lines without
+    a timestamp belong to the timestamped line above them."""
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    
+    def is_after_target(timestamp):
+        return timestamp >= target if inclusive else timestamp > target
+    
+    low, high = start, end
+    while low < high:
+        middle = (low + high) // 2
+        probe = _first_timestamp_at_or_after(f, middle, start, end, parse_timestamp)
+        if probe is None or is_after_target(probe[1]):
+            high = middle
+        else:
+            # Every offset up to this line start probes the same early line
+            low = probe[0] + 1
+    
+    probe = _first_timestamp_at_or_after(f, low, start, end, parse_timestamp)
+    return probe[0] if probe is not None else end
+
+
+def _incomplete_utf8_length(data: bytes) -> int:
+    """Return how many bytes at the end of data belong to an unfinished UTF-8 character."""
+    for length in range(1, min(4, len(data) + 1)):
+        byte = data[-length]
+        if byte & 0xC0 == 0x80:
+            continue  # Continuation byte; the lead byte is further back
+        if byte < 0xC0:
+            return 0
+        needed = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+        return length if needed > length else 0
+    return 0
+
+
+# Modules split out of this one; their public names stay importable from here
+_MOVED_TO = ("htail", "position_store", "file_watcher", "compressed", "terminal", "tmux_session")
+
+
+def __getattr__(name: str):
+    """Load a name that moved to another module on first use (e.g.
+    from ubitool.commands.utils import HtailReader). Loading lazily keeps
+    those modules, which import this one, from forming an import cycle."""
+    if not name.startswith('_'):
+        for module_name in _MOVED_TO:
+            module = importlib.import_module(f".{module_name}", __package__)
+            value = vars(module).get(name)
+            if value is not None and not isinstance(value, types.ModuleType):
+                return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")